@@ -1,7 +1,9 @@
+from pydantic import ConfigDict, field_validator
+from sqlalchemy import Index, text
 from sqlmodel import SQLModel, Field, Relationship
-from datetime import datetime
-from typing import Optional, List
-from decimal import Decimal
+from datetime import datetime, timezone
+from typing import Any, Optional, List
+from decimal import Decimal, InvalidOperation
 from enum import Enum
 
 
@@ -10,6 +12,28 @@ class AssetType(str, Enum):
     CRYPTOCURRENCY = "crypto"
 
 
+def utc_now() -> datetime:
+    """Current UTC time as a naive datetime, matching how timestamps are stored"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Holding amounts are stored with 8 decimal places to support crypto precision
+_Q8 = Decimal("0.00000001")
+
+
+def _to_amount(value: Any) -> Decimal:
+    """Convert a form or API value to a positive Decimal with 8 decimal places"""
+    try:
+        amount = value if isinstance(value, Decimal) else Decimal(str(value))
+        if amount.is_finite():
+            amount = amount.quantize(_Q8)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError("must be a valid number")
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError("must be a finite number greater than 0")
+    return amount
+
+
 # Persistent models (stored in database)
 class Portfolio(SQLModel, table=True):
     __tablename__ = "portfolios"  # type: ignore[assignment]
@@ -17,10 +41,12 @@ class Portfolio(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(max_length=100)
     description: str = Field(default="", max_length=500)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=utc_now)
+    updated_at: datetime = Field(default_factory=utc_now)
 
-    holdings: List["Holding"] = Relationship(back_populates="portfolio")
+    holdings: List["Holding"] = Relationship(
+        back_populates="portfolio", sa_relationship_kwargs={"order_by": "Holding.symbol"}
+    )
 
 
 class Holding(SQLModel, table=True):
@@ -32,24 +58,55 @@ class Holding(SQLModel, table=True):
     asset_type: AssetType = Field(default=AssetType.STOCK)
     quantity: Decimal = Field(gt=0, decimal_places=8)  # Support crypto precision
     purchase_price: Decimal = Field(gt=0, decimal_places=8)
-    purchase_date: datetime = Field(default_factory=datetime.utcnow)
+    purchase_date: datetime = Field(default_factory=utc_now)
     notes: str = Field(default="", max_length=1000)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=utc_now)
+    updated_at: datetime = Field(default_factory=utc_now)
 
     portfolio: Portfolio = Relationship(back_populates="holdings")
 
 
+class Symbol(SQLModel, table=True):
+    """Ticker symbol referenced by price history rows"""
+
+    __tablename__ = "symbols"  # type: ignore[assignment]
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    ticker: str = Field(max_length=20, unique=True)  # e.g., "AAPL", "BTC-USD"
+
+
 class PriceHistory(SQLModel, table=True):
     __tablename__ = "price_history"  # type: ignore[assignment]
+    # Latest-price lookups filter by symbol and order by newest timestamp; the composite index also covers
+    # symbol-only queries
+    __table_args__ = (Index("ix_price_history_symbol_ts", "symbol_id", text("timestamp DESC")),)
 
     id: Optional[int] = Field(default=None, primary_key=True)
-    symbol: str = Field(max_length=20, index=True)
-    price: Decimal = Field(gt=0, decimal_places=8)
-    timestamp: datetime = Field(default_factory=datetime.utcnow, index=True)
+    symbol_id: int = Field(foreign_key="symbols.id")
+    price: Decimal = Field(gt=0, max_digits=18, decimal_places=8)  # Fixed NUMERIC(18, 8), same scale as holdings
+    timestamp: datetime = Field(default_factory=utc_now, index=True)
     source: str = Field(default="yfinance", max_length=50)  # Track data source
 
 
+class PortfolioSummaryCache(SQLModel, table=True):
+    """Materialized portfolio summary, marked dirty on holding writes and price ingestion"""
+
+    __tablename__ = "portfolio_summary_cache"  # type: ignore[assignment]
+
+    portfolio_id: int = Field(foreign_key="portfolios.id", primary_key=True)
+    portfolio_name: str = Field(max_length=100)
+    total_holdings: int = Field(default=0)
+    total_cost: float = Field(default=0.0)
+    total_current_value: float = Field(default=0.0)
+    total_absolute_return: float = Field(default=0.0)
+    total_percentage_return: float = Field(default=0.0)
+    best_performer: Optional[str] = Field(default=None, max_length=20)
+    worst_performer: Optional[str] = Field(default=None, max_length=20)
+    last_updated: datetime = Field(default_factory=utc_now)
+    is_dirty: bool = Field(default=False)
+    version: int = Field(default=0)  # Bumped by every dirty mark, so a summary computed earlier cannot clear it
+
+
 # Non-persistent schemas (for validation, forms, API requests/responses)
 class PortfolioCreate(SQLModel, table=False):
     name: str = Field(max_length=100)
@@ -65,24 +122,38 @@ class HoldingCreate(SQLModel, table=False):
     portfolio_id: int
     symbol: str = Field(max_length=20)
     asset_type: AssetType = Field(default=AssetType.STOCK)
-    quantity: Decimal = Field(gt=0, decimal_places=8)
-    purchase_price: Decimal = Field(gt=0, decimal_places=8)
+    quantity: Decimal
+    purchase_price: Decimal
     purchase_date: Optional[datetime] = Field(default=None)
     notes: str = Field(default="", max_length=1000)
 
+    @field_validator("quantity", "purchase_price", mode="plain")
+    @classmethod
+    def validate_amount(cls, value: Any) -> Decimal:
+        """Validate and quantize amounts in a single step"""
+        return _to_amount(value)
+
 
 class HoldingUpdate(SQLModel, table=False):
     symbol: Optional[str] = Field(default=None, max_length=20)
     asset_type: Optional[AssetType] = Field(default=None)
-    quantity: Optional[Decimal] = Field(default=None, gt=0, decimal_places=8)
-    purchase_price: Optional[Decimal] = Field(default=None, gt=0, decimal_places=8)
+    quantity: Optional[Decimal] = Field(default=None)
+    purchase_price: Optional[Decimal] = Field(default=None)
     purchase_date: Optional[datetime] = Field(default=None)
     notes: Optional[str] = Field(default=None, max_length=1000)
 
+    @field_validator("quantity", "purchase_price", mode="plain")
+    @classmethod
+    def validate_amount(cls, value: Any) -> Optional[Decimal]:
+        """Validate and quantize amounts in a single step, leaving unset amounts alone"""
+        return None if value is None else _to_amount(value)
+
 
 class HoldingWithMetrics(SQLModel, table=False):
     """Schema for holding with calculated metrics"""
 
+    model_config = ConfigDict(frozen=True, extra="forbid")  # type: ignore[assignment]
+
     id: int
     portfolio_id: int
     symbol: str
@@ -94,25 +165,27 @@ class HoldingWithMetrics(SQLModel, table=False):
     created_at: datetime
     updated_at: datetime
 
-    # Calculated fields
-    current_price: Optional[Decimal] = Field(default=None)
-    current_value: Optional[Decimal] = Field(default=None)
-    total_cost: Optional[Decimal] = Field(default=None)
-    absolute_return: Optional[Decimal] = Field(default=None)
-    percentage_return: Optional[Decimal] = Field(default=None)
+    # Calculated fields (display values, computed in float64)
+    current_price: Optional[float] = Field(default=None)
+    current_value: Optional[float] = Field(default=None)
+    total_cost: Optional[float] = Field(default=None)
+    absolute_return: Optional[float] = Field(default=None)
+    percentage_return: Optional[float] = Field(default=None)
     last_updated: Optional[datetime] = Field(default=None)
 
 
 class PortfolioSummary(SQLModel, table=False):
     """Schema for portfolio summary with aggregated metrics"""
 
+    model_config = ConfigDict(frozen=True, extra="forbid")  # type: ignore[assignment]
+
     portfolio_id: int
     portfolio_name: str
     total_holdings: int
-    total_cost: Decimal
-    total_current_value: Decimal
-    total_absolute_return: Decimal
-    total_percentage_return: Decimal
+    total_cost: float
+    total_current_value: float
+    total_absolute_return: float
+    total_percentage_return: float
     best_performer: Optional[str] = Field(default=None)
     worst_performer: Optional[str] = Field(default=None)
     last_updated: datetime
@@ -121,6 +194,8 @@ class PortfolioSummary(SQLModel, table=False):
 class PriceData(SQLModel, table=False):
     """Schema for price data response"""
 
+    model_config = ConfigDict(frozen=True, extra="forbid")  # type: ignore[assignment]
+
     symbol: str
     price: Decimal
     timestamp: datetime
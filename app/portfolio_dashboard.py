@@ -1,43 +1,170 @@
-from nicegui import ui
+import asyncio
+import time
+import weakref
+from functools import lru_cache
+from nicegui import context, ui
+from datetime import datetime
 from decimal import Decimal
-from typing import Optional, List
+from typing import Any, ClassVar, Dict, Optional, List, Tuple
 from app.portfolio_service import portfolio_service
-from app.models import HoldingCreate, HoldingUpdate, AssetType, PortfolioCreate
+from app.models import HoldingCreate, HoldingUpdate, AssetType, Portfolio, PortfolioCreate
+
+
+@lru_cache(maxsize=4096)
+def _format_quantity(quantity: Decimal) -> str:
+    """Format a holding quantity without trailing zeros"""
+    return f"{quantity:,.8f}".rstrip("0").rstrip(".")
+
+
+@lru_cache(maxsize=4096)
+def _format_price(price: Decimal) -> str:
+    """Format a purchase price as dollars"""
+    return f"${price:.2f}"
 
 
 class PortfolioDashboard:
+    # Refreshes requested within this window of the previous one are coalesced
+    REFRESH_DEBOUNCE_SECONDS = 0.2
+    # Portfolio list is reused across selector and page setup for this long
+    PORTFOLIOS_CACHE_SECONDS = 5.0
+
+    # Dashboards of open pages, so a new portfolio shows up in every client's selector
+    _open_dashboards: ClassVar["weakref.WeakSet[PortfolioDashboard]"] = weakref.WeakSet()
+
+    # Holdings table row layout; rows are built from value tuples in this order
+    _ROW_KEYS: ClassVar[Tuple[str, ...]] = (
+        "id",
+        "symbol",
+        "asset_type",
+        "quantity",
+        "purchase_price",
+        "current_price",
+        "total_cost",
+        "current_value",
+        "absolute_return",
+        "percentage_return",
+        "asset_type_value",
+        "quantity_value",
+        "purchase_price_value",
+        "notes",
+    )
+
+    # Static Quasar cell templates for the holdings table
+    _CELL_SLOTS: ClassVar[Dict[str, str]] = {
+        "body-cell-current_price": """
+            <q-td :props="props" :class="props.row.current_price ? '' : 'text-gray-400'">
+                {{ props.row.current_price ? '$' + parseFloat(props.row.current_price).toFixed(2) : 'Loading...' }}
+            </q-td>
+        """,
+        "body-cell-total_cost": """
+            <q-td :props="props">
+                ${{ parseFloat(props.row.total_cost).toFixed(2) }}
+            </q-td>
+        """,
+        "body-cell-current_value": """
+            <q-td :props="props" :class="props.row.current_value ? '' : 'text-gray-400'">
+                {{ props.row.current_value ? '$' + parseFloat(props.row.current_value).toFixed(2) : 'N/A' }}
+            </q-td>
+        """,
+        "body-cell-absolute_return": """
+            <q-td :props="props" :class="props.row.absolute_return ? (parseFloat(props.row.absolute_return) >= 0 ? 'text-green-600' : 'text-red-600') : 'text-gray-400'">
+                {{ props.row.absolute_return ? (parseFloat(props.row.absolute_return) >= 0 ? '+' : '') + '$' + parseFloat(props.row.absolute_return).toFixed(2) : 'N/A' }}
+            </q-td>
+        """,
+        "body-cell-percentage_return": """
+            <q-td :props="props" :class="props.row.percentage_return ? (parseFloat(props.row.percentage_return) >= 0 ? 'text-green-600' : 'text-red-600') : 'text-gray-400'">
+                {{ props.row.percentage_return ? (parseFloat(props.row.percentage_return) >= 0 ? '+' : '') + parseFloat(props.row.percentage_return).toFixed(2) + '%' : 'N/A' }}
+            </q-td>
+        """,
+        "body-cell-actions": """
+            <q-td :props="props">
+                <q-btn flat color="primary" icon="edit" size="sm" @click="$parent.$emit('edit-holding', props.row)" />
+                <q-btn flat color="negative" icon="delete" size="sm" @click="$parent.$emit('delete-holding', props.row)" />
+            </q-td>
+        """,
+    }
+
+    __slots__ = (
+        "current_portfolio_id",
+        "holdings_table",
+        "summary_cards",
+        "summary_row",
+        "refresh_timer",
+        "auto_refresh",
+        "_tab_visible",
+        "_row_cache",
+        "_refresh_task",
+        "_refresh_generation",
+        "_last_refresh_started",
+        "portfolio_selector",
+        "_portfolios_cache",
+        "_portfolios_cache_ts",
+        "__weakref__",
+    )
+
     def __init__(self):
         self.current_portfolio_id: Optional[int] = None
         self.holdings_table: Optional[ui.table] = None
         self.summary_cards: List[ui.card] = []
         self.refresh_timer: Optional[ui.timer] = None
         self.auto_refresh = True
-
-    def create_portfolio_selector(self) -> ui.select:
-        """Create portfolio selector dropdown"""
+        self._tab_visible = True
+        self._row_cache: Dict[Tuple[int, datetime, Optional[float]], Dict[str, Any]] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._refresh_generation = 0
+        self._last_refresh_started = 0.0
+        self.portfolio_selector: Optional[ui.select] = None
+        self._portfolios_cache: Optional[List[Portfolio]] = None
+        self._portfolios_cache_ts = 0.0
+        self._open_dashboards.add(self)
+
+    def get_portfolios(self) -> List[Portfolio]:
+        """Get all portfolios, cached for a few seconds"""
+        now = time.monotonic()
+        if self._portfolios_cache is None or now - self._portfolios_cache_ts > self.PORTFOLIOS_CACHE_SECONDS:
+            self._portfolios_cache = portfolio_service.get_all_portfolios()
+            self._portfolios_cache_ts = now
+        return self._portfolios_cache
+
+    def set_portfolios(self, portfolios: List[Portfolio]) -> None:
+        """Replace the cached portfolio list and update the selector options in place"""
+        self._portfolios_cache = portfolios
+        self._portfolios_cache_ts = time.monotonic()
+        if self.portfolio_selector is not None and not self.portfolio_selector.is_deleted:
+            self.portfolio_selector.set_options(self.portfolio_options())
+
+    @classmethod
+    def broadcast_portfolios(cls) -> None:
+        """Push the current portfolio list to the selectors of all open dashboards"""
         portfolios = portfolio_service.get_all_portfolios()
+        for dashboard in list(cls._open_dashboards):
+            dashboard.set_portfolios(portfolios)
 
-        # Create options for dropdown
-        options = []
-        for portfolio in portfolios:
-            options.append({"label": portfolio.name, "value": portfolio.id})
+    def portfolio_options(self) -> Dict[Any, str]:
+        """Build portfolio selector options"""
+        options: Dict[Any, str] = {portfolio.id: portfolio.name for portfolio in self.get_portfolios()}
 
         # Add "Create New" option
-        options.append({"label": "+ Create New Portfolio", "value": "create_new"})
+        options["create_new"] = "+ Create New Portfolio"
+        return options
 
-        selector = ui.select(options=options, value=self.current_portfolio_id, label="Select Portfolio").classes("w-64")
+    def create_portfolio_selector(self) -> ui.select:
+        """Create portfolio selector dropdown"""
+        options = self.portfolio_options()
+        value = self.current_portfolio_id if self.current_portfolio_id in options else None
+        selector = ui.select(options=options, value=value, label="Select Portfolio").classes("w-64")
 
-        def on_portfolio_change(e):
+        async def on_portfolio_change(e):
+            if e.value == self.current_portfolio_id:
+                return
             if e.value == "create_new":
-                # Create task for async call
-                import asyncio
-
-                asyncio.create_task(self.show_create_portfolio_dialog())
+                await self.show_create_portfolio_dialog()
             else:
                 self.current_portfolio_id = e.value
                 self.refresh_dashboard()
 
-        selector.on("update:model-value", on_portfolio_change)
+        selector.on_value_change(on_portfolio_change)
+        self.portfolio_selector = selector
         return selector
 
     async def show_create_portfolio_dialog(self):
@@ -78,8 +205,11 @@ class PortfolioDashboard:
             ui.notify(f'Portfolio "{portfolio.name}" created successfully!', type="positive")
             dialog.close()
 
-            # Refresh the entire page to update portfolio selector
-            ui.navigate.reload()
+            # Update the portfolio selectors of every client in place instead of reloading pages
+            self.broadcast_portfolios()
+            if self.portfolio_selector is not None:
+                self.portfolio_selector.set_value(portfolio.id)
+            self.refresh_dashboard()
 
         except Exception as e:
             ui.notify(f"Error creating portfolio: {str(e)}", type="negative")
@@ -125,7 +255,8 @@ class PortfolioDashboard:
                     ui.label("Return on Investment").classes("text-sm text-gray-500 uppercase tracking-wider")
                     roi_color = "text-green-500" if summary.total_percentage_return >= 0 else "text-red-500"
                     ui.label(f"{summary.total_percentage_return:+.2f}%").classes(f"text-3xl font-bold {roi_color} mt-2")
-                    ui.label(f"Updated: {summary.last_updated.strftime('%H:%M')}").classes("text-sm text-gray-500 mt-1")
+                    updated_at = summary.last_updated.strftime("%H:%M")
+                    ui.label(f"Updated: {updated_at} UTC").classes("text-sm text-gray-500 mt-1")
 
                 # Best/Worst Performer Card
                 with ui.card().classes("p-6 bg-white shadow-lg rounded-xl hover:shadow-xl transition-shadow"):
@@ -143,10 +274,16 @@ class PortfolioDashboard:
     def create_holdings_table(self):
         """Create the holdings table"""
         columns = [
-            {"name": "symbol", "label": "Symbol", "field": "symbol", "align": "left"},
-            {"name": "asset_type", "label": "Type", "field": "asset_type", "align": "left"},
-            {"name": "quantity", "label": "Quantity", "field": "quantity", "align": "right"},
-            {"name": "purchase_price", "label": "Purchase Price", "field": "purchase_price", "align": "right"},
+            {"name": "symbol", "label": "Symbol", "field": "symbol", "align": "left", "sortable": True},
+            {"name": "asset_type", "label": "Type", "field": "asset_type", "align": "left", "sortable": True},
+            {"name": "quantity", "label": "Quantity", "field": "quantity", "align": "right", "sortable": True},
+            {
+                "name": "purchase_price",
+                "label": "Purchase Price",
+                "field": "purchase_price",
+                "align": "right",
+                "sortable": True,
+            },
             {"name": "current_price", "label": "Current Price", "field": "current_price", "align": "right"},
             {"name": "total_cost", "label": "Total Cost", "field": "total_cost", "align": "right"},
             {"name": "current_value", "label": "Current Value", "field": "current_value", "align": "right"},
@@ -155,95 +292,103 @@ class PortfolioDashboard:
             {"name": "actions", "label": "Actions", "field": "actions", "align": "center"},
         ]
 
-        self.holdings_table = ui.table(columns=columns, rows=[], row_key="id").classes("w-full")
-
-        # Add custom styling for the table
-        self.holdings_table.add_slot(
-            "body-cell-current_price",
-            """
-            <q-td :props="props" :class="props.row.current_price ? '' : 'text-gray-400'">
-                {{ props.row.current_price ? '$' + parseFloat(props.row.current_price).toFixed(2) : 'Loading...' }}
-            </q-td>
-        """,
-        )
-
-        self.holdings_table.add_slot(
-            "body-cell-total_cost",
-            """
-            <q-td :props="props">
-                ${{ parseFloat(props.row.total_cost).toFixed(2) }}
-            </q-td>
-        """,
-        )
-
-        self.holdings_table.add_slot(
-            "body-cell-current_value",
-            """
-            <q-td :props="props" :class="props.row.current_value ? '' : 'text-gray-400'">
-                {{ props.row.current_value ? '$' + parseFloat(props.row.current_value).toFixed(2) : 'N/A' }}
-            </q-td>
-        """,
-        )
-
-        self.holdings_table.add_slot(
-            "body-cell-absolute_return",
-            """
-            <q-td :props="props" :class="props.row.absolute_return ? (parseFloat(props.row.absolute_return) >= 0 ? 'text-green-600' : 'text-red-600') : 'text-gray-400'">
-                {{ props.row.absolute_return ? (parseFloat(props.row.absolute_return) >= 0 ? '+' : '') + '$' + parseFloat(props.row.absolute_return).toFixed(2) : 'N/A' }}
-            </q-td>
-        """,
-        )
-
-        self.holdings_table.add_slot(
-            "body-cell-percentage_return",
-            """
-            <q-td :props="props" :class="props.row.percentage_return ? (parseFloat(props.row.percentage_return) >= 0 ? 'text-green-600' : 'text-red-600') : 'text-gray-400'">
-                {{ props.row.percentage_return ? (parseFloat(props.row.percentage_return) >= 0 ? '+' : '') + parseFloat(props.row.percentage_return).toFixed(2) + '%' : 'N/A' }}
-            </q-td>
-        """,
+        # Server-side pagination: rowsNumber makes Quasar emit "request" instead of paging locally
+        self.holdings_table = (
+            ui.table(
+                columns=columns,
+                rows=[],
+                row_key="id",
+                pagination={"page": 1, "rowsPerPage": 25, "sortBy": "symbol", "descending": False, "rowsNumber": 0},
+            )
+            .classes("w-full")
+            .props(":rows-per-page-options=[10,25,50,100]")
         )
+        self.holdings_table.on("request", self.handle_holdings_request)
 
-        self.holdings_table.add_slot(
-            "body-cell-actions",
-            """
-            <q-td :props="props">
-                <q-btn flat color="primary" icon="edit" size="sm" @click="$parent.$emit('edit-holding', props.row.id)" />
-                <q-btn flat color="negative" icon="delete" size="sm" @click="$parent.$emit('delete-holding', props.row.id)" />
-            </q-td>
-        """,
-        )
+        # Add custom styling for the table
+        for name, template in self._CELL_SLOTS.items():
+            self.holdings_table.add_slot(name, template)
 
         self.holdings_table.on("edit-holding", self.edit_holding)
         self.holdings_table.on("delete-holding", self.delete_holding)
 
         return self.holdings_table
 
+    async def handle_holdings_request(self, e):
+        """Handle a page or sort change from the holdings table"""
+        if self.holdings_table is None:
+            return
+
+        self.holdings_table.pagination = {**self.holdings_table.pagination, **e.args["pagination"]}
+        await self.refresh_holdings_table()
+
     async def refresh_holdings_table(self):
-        """Refresh the holdings table with current data"""
+        """Refresh the visible page of the holdings table with current data"""
         if self.current_portfolio_id is None or self.holdings_table is None:
             return
 
         try:
-            holdings = await portfolio_service.get_holdings_with_metrics(self.current_portfolio_id)
+            pagination = dict(self.holdings_table.pagination)
+            rows_per_page = pagination.get("rowsPerPage") or None  # 0 means all rows
+            total = await asyncio.to_thread(portfolio_service.count_portfolio_holdings, self.current_portfolio_id)
+
+            page = pagination.get("page") or 1
+            if rows_per_page is not None and (page - 1) * rows_per_page >= total:
+                page = 1
+            offset = (page - 1) * rows_per_page if rows_per_page is not None else 0
+
+            batch = await portfolio_service.get_holdings_batch(
+                self.current_portfolio_id,
+                offset=offset,
+                limit=rows_per_page,
+                sort_by=pagination.get("sortBy") or "symbol",
+                descending=bool(pagination.get("descending")),
+            )
+
+            # A page or sort request that arrived during the awaits above has superseded this page
+            current = self.holdings_table.pagination
+            if any(current.get(key) != pagination.get(key) for key in ("page", "rowsPerPage", "sortBy", "descending")):
+                return
 
-            # Convert holdings to table rows
+            # Convert holdings to table rows, reusing rows whose holding and price are unchanged
             rows = []
-            for holding in holdings:
-                row = {
-                    "id": holding.id,
-                    "symbol": holding.symbol,
-                    "asset_type": holding.asset_type.value.title(),
-                    "quantity": f"{holding.quantity:,.8f}".rstrip("0").rstrip("."),
-                    "purchase_price": f"${holding.purchase_price:.2f}",
-                    "current_price": float(holding.current_price) if holding.current_price else None,
-                    "total_cost": float(holding.total_cost) if holding.total_cost else 0,
-                    "current_value": float(holding.current_value) if holding.current_value else None,
-                    "absolute_return": float(holding.absolute_return) if holding.absolute_return else None,
-                    "percentage_return": float(holding.percentage_return) if holding.percentage_return else None,
-                }
+            row_cache = {}
+            columns = zip(
+                batch.holdings,
+                batch.values("current_price"),
+                batch.total_cost.tolist(),
+                batch.values("current_value"),
+                batch.values("absolute_return"),
+                batch.values("percentage_return"),
+                batch.quantity.tolist(),
+                batch.purchase_price.tolist(),
+            )
+            for holding, current_price, total_cost, current_value, absolute_return, percentage_return, *raw in columns:
+                key = (holding.id, holding.updated_at, current_price)
+                row = self._row_cache.get(key)
+                if row is None:
+                    values = (
+                        holding.id,
+                        holding.symbol,
+                        holding.asset_type.value.title(),
+                        _format_quantity(holding.quantity),
+                        _format_price(holding.purchase_price),
+                        current_price,
+                        total_cost,
+                        current_value,
+                        absolute_return,
+                        percentage_return,
+                        holding.asset_type.value,
+                        *raw,
+                        holding.notes,
+                    )
+                    row = dict(zip(self._ROW_KEYS, values))
+                row_cache[key] = row
                 rows.append(row)
 
+            self._row_cache = row_cache
             self.holdings_table.rows = rows
+            self.holdings_table.pagination = {**pagination, "page": page, "rowsNumber": total}
 
         except Exception as e:
             ui.notify(f"Error refreshing holdings: {str(e)}", type="negative")
@@ -261,7 +406,7 @@ class PortfolioDashboard:
                 symbol_input = ui.input(label="Symbol", placeholder="e.g., AAPL, BTC-USD").classes("flex-1")
 
                 asset_type_select = ui.select(
-                    options=[{"label": "Stock", "value": "stock"}, {"label": "Cryptocurrency", "value": "crypto"}],
+                    options={"stock": "Stock", "crypto": "Cryptocurrency"},
                     value="stock",
                     label="Asset Type",
                 ).classes("flex-1")
@@ -336,37 +481,33 @@ class PortfolioDashboard:
             ui.notify(f"Error adding holding: {str(e)}", type="negative")
 
     async def edit_holding(self, e):
-        """Edit an existing holding"""
-        holding_id = e.args
-        holding = portfolio_service.get_holding(holding_id)
-
-        if holding is None:
-            ui.notify("Holding not found", type="negative")
-            return
+        """Edit an existing holding, seeding the dialog from the table row"""
+        row = e.args
+        holding_id = row["id"]
 
         with ui.dialog() as dialog, ui.card():
             ui.label("Edit Holding").classes("text-lg font-bold mb-4")
 
             with ui.row().classes("gap-4 w-full"):
-                symbol_input = ui.input(label="Symbol", value=holding.symbol).classes("flex-1")
+                symbol_input = ui.input(label="Symbol", value=row["symbol"]).classes("flex-1")
 
                 asset_type_select = ui.select(
-                    options=[{"label": "Stock", "value": "stock"}, {"label": "Cryptocurrency", "value": "crypto"}],
-                    value=holding.asset_type.value,
+                    options={"stock": "Stock", "crypto": "Cryptocurrency"},
+                    value=row["asset_type_value"],
                     label="Asset Type",
                 ).classes("flex-1")
 
             with ui.row().classes("gap-4 w-full"):
                 quantity_input = ui.number(
-                    label="Quantity", value=float(holding.quantity), min=0.00000001, step=0.1
+                    label="Quantity", value=row["quantity_value"], min=0.00000001, step=0.1
                 ).classes("flex-1")
 
                 purchase_price_input = ui.number(
-                    label="Purchase Price ($)", value=float(holding.purchase_price), min=0.01, step=0.01
+                    label="Purchase Price ($)", value=row["purchase_price_value"], min=0.01, step=0.01
                 ).classes("flex-1")
 
             notes_input = (
-                ui.textarea(label="Notes (Optional)", value=holding.notes).classes("w-full mb-4").props("rows=2")
+                ui.textarea(label="Notes (Optional)", value=row["notes"]).classes("w-full mb-4").props("rows=2")
             )
 
             with ui.row().classes("gap-2 justify-end"):
@@ -418,7 +559,9 @@ class PortfolioDashboard:
                 notes=notes.strip() if notes else "",
             )
 
-            portfolio_service.update_holding(holding_id, holding_data)
+            if portfolio_service.update_holding(holding_id, holding_data) is None:
+                ui.notify("Holding not found", type="negative")
+                return
             ui.notify("Holding updated successfully!", type="positive")
             dialog.close()
 
@@ -430,16 +573,12 @@ class PortfolioDashboard:
 
     async def delete_holding(self, e):
         """Delete a holding with confirmation"""
-        holding_id = e.args
-        holding = portfolio_service.get_holding(holding_id)
-
-        if holding is None:
-            ui.notify("Holding not found", type="negative")
-            return
+        row = e.args
+        holding_id = row["id"]
 
         with ui.dialog() as dialog, ui.card():
             ui.label("Confirm Delete").classes("text-lg font-bold mb-4")
-            ui.label(f"Are you sure you want to delete the holding for {holding.symbol}?").classes("mb-4")
+            ui.label(f"Are you sure you want to delete the holding for {row['symbol']}?").classes("mb-4")
 
             with ui.row().classes("gap-2 justify-end"):
                 ui.button("Cancel", on_click=dialog.close).props("outline")
@@ -452,7 +591,9 @@ class PortfolioDashboard:
     def confirm_delete_holding(self, dialog, holding_id: int):
         """Confirm deletion of holding"""
         try:
-            portfolio_service.delete_holding(holding_id)
+            if not portfolio_service.delete_holding(holding_id):
+                ui.notify("Holding not found", type="negative")
+                return
             ui.notify("Holding deleted successfully!", type="positive")
             dialog.close()
 
@@ -468,42 +609,90 @@ class PortfolioDashboard:
             return
 
         # Schedule async refresh
-        ui.run_javascript("""
-            setTimeout(() => {
-                emitEvent('refresh-dashboard');
-            }, 100);
-        """)
+        self._start_refresh()
 
     async def handle_refresh_dashboard(self):
         """Handle dashboard refresh event"""
-        await self.refresh_summary()
-        await self.refresh_holdings_table()
+        await asyncio.wait({self._start_refresh()})
+
+    def _start_refresh(self) -> asyncio.Task:
+        """Start a refresh task for the current client, superseding any refresh still in flight"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+
+        self._refresh_generation += 1
+        self._refresh_task = asyncio.create_task(self._run_refresh(self._refresh_generation, context.client))
+        return self._refresh_task
+
+    async def handle_timer_refresh(self):
+        """Handle auto-refresh timer tick, skipping it while another refresh is in flight"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+
+        await self.handle_refresh_dashboard()
+
+    async def _run_refresh(self, generation: int, client) -> None:
+        """Refresh summary and holdings once the debounce window since the last refresh has passed"""
+        try:
+            delay = self._last_refresh_started + self.REFRESH_DEBOUNCE_SECONDS - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if generation != self._refresh_generation:
+                return
+
+            self._last_refresh_started = time.monotonic()
+            with client:
+                await self.refresh_summary()
+                await self.refresh_holdings_table()
+        except asyncio.CancelledError:
+            pass  # Superseded by a newer refresh
 
     def setup_auto_refresh(self):
         """Setup automatic refresh timer"""
 
         def toggle_auto_refresh():
-            if self.auto_refresh:
-                if self.refresh_timer:
-                    self.refresh_timer.deactivate()
-                    self.refresh_timer = None
-                self.auto_refresh = False
-            else:
-                self.refresh_timer = ui.timer(30, self.handle_refresh_dashboard)  # Refresh every 30 seconds
-                self.auto_refresh = True
+            self.auto_refresh = not self.auto_refresh
+            self._sync_refresh_timer()
 
         # Start with auto-refresh enabled
-        self.refresh_timer = ui.timer(30, self.handle_refresh_dashboard)
+        self.refresh_timer = ui.timer(30, self.handle_timer_refresh)  # Refresh every 30 seconds
+
+        # Pause the timer while this client's browser tab is hidden
+        ui.add_body_html(
+            "<script>document.addEventListener('visibilitychange', () => "
+            "emitEvent(document.hidden ? 'dashboard-hidden' : 'dashboard-visible'));</script>"
+        )
+        ui.on("dashboard-hidden", self.pause_auto_refresh)
+        ui.on("dashboard-visible", self.resume_auto_refresh)
 
         return toggle_auto_refresh
 
+    def _sync_refresh_timer(self):
+        """Run the timer only while auto-refresh is on and the tab is visible"""
+        if self.refresh_timer:
+            self.refresh_timer.active = self.auto_refresh and self._tab_visible
+
+    def pause_auto_refresh(self):
+        """Stop timer refreshes while the dashboard is not visible"""
+        self._tab_visible = False
+        self._sync_refresh_timer()
+
+    def resume_auto_refresh(self):
+        """Restart timer refreshes and catch up once the dashboard is visible again"""
+        self._tab_visible = True
+        self._sync_refresh_timer()
+        if self.auto_refresh:
+            self.refresh_dashboard()
+
 
 def create():
     """Create the portfolio dashboard module"""
-    dashboard = PortfolioDashboard()
 
     @ui.page("/")
     async def portfolio_page():
+        # One dashboard per client: selection, refresh state, timer and caches must not leak between browsers
+        dashboard = PortfolioDashboard()
+
         # Apply modern color theme
         ui.colors(
             primary="#2563eb",
@@ -554,16 +743,12 @@ def create():
                 # Holdings table
                 dashboard.create_holdings_table()
 
-        # Setup event handlers
-        ui.on("refresh-dashboard", dashboard.handle_refresh_dashboard)
-
-        # Initial load
-        await dashboard.handle_refresh_dashboard()
-
         # Set up initial portfolio if none selected
         if dashboard.current_portfolio_id is None:
-            portfolios = portfolio_service.get_all_portfolios()
+            portfolios = dashboard.get_portfolios()
             if portfolios:
                 dashboard.current_portfolio_id = portfolios[0].id
                 portfolio_selector.set_value(portfolios[0].id)
-                await dashboard.handle_refresh_dashboard()
+
+        # Initial load
+        await dashboard.handle_refresh_dashboard()
@@ -1,22 +1,140 @@
-from decimal import Decimal
+import asyncio
+import math
+from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Optional
-from sqlmodel import select
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, col, delete, func, select, update
 from app.database import get_session
 from app.models import (
     Portfolio,
     Holding,
+    PortfolioSummaryCache,
     HoldingCreate,
     HoldingUpdate,
     HoldingWithMetrics,
     PortfolioSummary,
     PortfolioCreate,
     PortfolioUpdate,
+    utc_now,
+)
+from app.price_service import price_service, summary_in_progress
+
+# HoldingWithMetrics rows are assembled from Holding rows loaded through SQLAlchemy plus prices from
+# price_service, so the data is guaranteed to be valid — build them with model_construct to skip
+# per-field validation. User input (HoldingCreate/HoldingUpdate) keeps full validation.
+_METRICS_FIELDS_SET = set(HoldingWithMetrics.model_fields)
+
+
+# Clean cached summaries are served for as long as the prices behind them stay cached
+_SUMMARY_CACHE_TTL = 300  # seconds
+
+
+# Stored prices younger than this are used for summaries without a live fetch, matching the price cache duration
+_STORED_PRICE_MAX_AGE = 300  # seconds
+
+
+# Columns the holdings table may sort by server-side
+_HOLDING_SORT_COLUMNS = {
+    "symbol": Holding.symbol,
+    "asset_type": Holding.asset_type,
+    "quantity": Holding.quantity,
+    "purchase_price": Holding.purchase_price,
+    "purchase_date": Holding.purchase_date,
+}
+
+
+# Holding columns read by the metrics paths, loaded as plain rows to skip ORM instance construction. Typed loosely:
+# select() only has typed overloads for up to four columns
+_HOLDING_COLUMNS: Tuple[Any, ...] = (
+    Holding.id,
+    Holding.portfolio_id,
+    Holding.symbol,
+    Holding.asset_type,
+    Holding.quantity,
+    Holding.purchase_price,
+    Holding.purchase_date,
+    Holding.notes,
+    Holding.created_at,
+    Holding.updated_at,
 )
-from app.price_service import price_service
+
+
+def _holdings_page(statement, portfolio_id: int, offset: int, limit: Optional[int], sort_by: str, descending: bool):
+    """Restrict a holdings query to one sorted page of a portfolio"""
+    sort_column = _HOLDING_SORT_COLUMNS.get(sort_by, Holding.symbol)
+    return (
+        statement.where(Holding.portfolio_id == portfolio_id)
+        .order_by(col(sort_column).desc() if descending else col(sort_column), col(Holding.id))
+        .offset(offset)
+        .limit(limit)
+    )
+
+
+def _mark_summary_dirty(session: Session, portfolio_id: int) -> None:
+    """Flag the cached summary of a portfolio for recomputation on next read"""
+    statement = (
+        update(PortfolioSummaryCache)
+        .where(col(PortfolioSummaryCache.portfolio_id) == portfolio_id)
+        .values(is_dirty=True, version=col(PortfolioSummaryCache.version) + 1)
+    )
+    session.exec(statement)  # type: ignore[call-overload]
+
+
+@dataclass
+class HoldingsBatch:
+    """Holdings with metrics stored as parallel float64 columns, NaN where no current price is known"""
+
+    holdings: List[Any]  # Holding instances or rows of _HOLDING_COLUMNS
+    quantity: np.ndarray
+    purchase_price: np.ndarray
+    current_price: np.ndarray
+    total_cost: np.ndarray
+    current_value: np.ndarray
+    absolute_return: np.ndarray
+    percentage_return: np.ndarray
+    last_updated: datetime
+
+    def __len__(self) -> int:
+        return len(self.holdings)
+
+    def values(self, column: str) -> List[Optional[float]]:
+        """Get a metric column as Python floats, mapping NaN (no price) to None"""
+        array: np.ndarray = getattr(self, column)
+        return [None if math.isnan(value) else value for value in array.tolist()]
+
+
+# Async callable returning the current price (or None) of each requested symbol, like price_service.get_multiple_prices
+PriceProvider = Callable[[List[str]], Awaitable[Dict[str, Optional[Decimal]]]]
 
 
 class PortfolioService:
+    def __init__(self, price_provider: Optional[PriceProvider] = None):
+        # Without a provider, prices come from price_service.get_multiple_prices, looked up on every call
+        self.price_provider = price_provider
+
+    async def _get_prices(self, symbols: List[str]) -> Dict[str, Optional[Decimal]]:
+        """Get current prices from the injected provider, or from price_service by default"""
+        provider = self.price_provider or price_service.get_multiple_prices
+        return await provider(symbols)
+
+    async def _get_summary_prices(self, symbols: List[str]) -> Dict[str, Optional[Decimal]]:
+        """Get prices for a summary from fresh stored prices, fetching only missing or stale symbols live"""
+        if self.price_provider is not None:
+            # Price history is written by price_service, so it says nothing about an injected provider's prices
+            return await self._get_prices(symbols)
+
+        prices: Dict[str, Optional[Decimal]] = dict(
+            await asyncio.to_thread(price_service.get_stored_prices, symbols, _STORED_PRICE_MAX_AGE)
+        )
+        stale = [symbol for symbol in symbols if symbol not in prices]
+        if stale:
+            prices.update(await self._get_prices(stale))
+        return prices
+
     def create_portfolio(self, portfolio_data: PortfolioCreate) -> Portfolio:
         """Create a new portfolio"""
         with get_session() as session:
@@ -49,8 +167,9 @@ class PortfolioService:
             if portfolio_data.description is not None:
                 portfolio.description = portfolio_data.description
 
-            portfolio.updated_at = datetime.utcnow()
+            portfolio.updated_at = utc_now()
             session.add(portfolio)
+            _mark_summary_dirty(session, portfolio_id)
             session.commit()
             session.refresh(portfolio)
             return portfolio
@@ -58,49 +177,90 @@ class PortfolioService:
     def delete_portfolio(self, portfolio_id: int) -> bool:
         """Delete portfolio and all its holdings"""
         with get_session() as session:
-            portfolio = session.get(Portfolio, portfolio_id)
-            if portfolio is None:
-                return False
-
-            # Delete all holdings first
-            statement = select(Holding).where(Holding.portfolio_id == portfolio_id)
-            holdings = session.exec(statement)
-            for holding in holdings:
-                session.delete(holding)
+            # Delete cached summary and all holdings first, one statement each
+            for model in (PortfolioSummaryCache, Holding):
+                session.exec(delete(model).where(col(model.portfolio_id) == portfolio_id))  # type: ignore[call-overload]
 
             # Delete portfolio
-            session.delete(portfolio)
+            result = session.exec(delete(Portfolio).where(col(Portfolio.id) == portfolio_id))  # type: ignore[call-overload]
             session.commit()
-            return True
+            return result.rowcount > 0
 
     def add_holding(self, holding_data: HoldingCreate) -> Holding:
         """Add a new holding to a portfolio"""
+        return self.add_holdings([holding_data])[0]
+
+    def add_holdings(self, holdings_data: List[HoldingCreate]) -> List[Holding]:
+        """Add several holdings in one transaction"""
+        now = utc_now()
         with get_session() as session:
-            holding = Holding(
-                portfolio_id=holding_data.portfolio_id,
-                symbol=holding_data.symbol.upper(),
-                asset_type=holding_data.asset_type,
-                quantity=holding_data.quantity,
-                purchase_price=holding_data.purchase_price,
-                purchase_date=holding_data.purchase_date or datetime.utcnow(),
-                notes=holding_data.notes,
-            )
-            session.add(holding)
+            holdings = [
+                Holding(
+                    portfolio_id=holding_data.portfolio_id,
+                    symbol=holding_data.symbol.upper(),
+                    asset_type=holding_data.asset_type,
+                    quantity=holding_data.quantity,
+                    purchase_price=holding_data.purchase_price,
+                    purchase_date=holding_data.purchase_date or now,
+                    notes=holding_data.notes,
+                    created_at=now,
+                    updated_at=now,
+                )
+                for holding_data in holdings_data
+            ]
+            session.add_all(holdings)
+            for portfolio_id in {holding.portfolio_id for holding in holdings}:
+                _mark_summary_dirty(session, portfolio_id)
+            session.flush()
+            holding_ids = [holding.id for holding in holdings]
             session.commit()
-            session.refresh(holding)
-            return holding
+            # Reload the committed rows with one SELECT instead of refreshing each holding
+            session.exec(select(Holding).where(col(Holding.id).in_(holding_ids))).all()
+            return holdings
 
     def get_holding(self, holding_id: int) -> Optional[Holding]:
         """Get holding by ID"""
         with get_session() as session:
             return session.get(Holding, holding_id)
 
-    def get_portfolio_holdings(self, portfolio_id: int) -> List[Holding]:
-        """Get all holdings for a portfolio"""
+    def get_portfolio_holdings(
+        self,
+        portfolio_id: int,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        sort_by: str = "symbol",
+        descending: bool = False,
+    ) -> List[Holding]:
+        """Get holdings for a portfolio, optionally one sorted page at a time"""
         with get_session() as session:
-            statement = select(Holding).where(Holding.portfolio_id == portfolio_id).order_by(Holding.symbol)
+            statement = _holdings_page(select(Holding), portfolio_id, offset, limit, sort_by, descending)
             return list(session.exec(statement))
 
+    def _get_holding_rows(
+        self, portfolio_id: int, offset: int, limit: Optional[int], sort_by: str, descending: bool
+    ) -> List[Any]:
+        """Get one sorted page of holdings as column rows rather than ORM instances"""
+        with get_session() as session:
+            statement = _holdings_page(select(*_HOLDING_COLUMNS), portfolio_id, offset, limit, sort_by, descending)
+            return list(session.exec(statement).all())
+
+    def count_portfolio_holdings(self, portfolio_id: int) -> int:
+        """Count holdings in a portfolio"""
+        with get_session() as session:
+            statement = select(func.count()).select_from(Holding).where(Holding.portfolio_id == portfolio_id)
+            return session.exec(statement).one()
+
+    def get_popular_symbols(self, limit: int = 20) -> List[str]:
+        """Get the symbols held most often across all portfolios"""
+        with get_session() as session:
+            statement = (
+                select(Holding.symbol)
+                .group_by(Holding.symbol)
+                .order_by(func.count().desc(), Holding.symbol)
+                .limit(limit)
+            )
+            return list(session.exec(statement).all())
+
     def update_holding(self, holding_id: int, holding_data: HoldingUpdate) -> Optional[Holding]:
         """Update a holding"""
         with get_session() as session:
@@ -121,8 +281,9 @@ class PortfolioService:
             if holding_data.notes is not None:
                 holding.notes = holding_data.notes
 
-            holding.updated_at = datetime.utcnow()
+            holding.updated_at = utc_now()
             session.add(holding)
+            _mark_summary_dirty(session, holding.portfolio_id)
             session.commit()
             session.refresh(holding)
             return holding
@@ -135,40 +296,61 @@ class PortfolioService:
                 return False
 
             session.delete(holding)
+            _mark_summary_dirty(session, holding.portfolio_id)
             session.commit()
             return True
 
-    async def get_holdings_with_metrics(self, portfolio_id: int) -> List[HoldingWithMetrics]:
+    def get_portfolio_with_holdings(self, portfolio_id: int) -> Optional[Portfolio]:
+        """Get portfolio by ID with its holdings eagerly loaded in a single extra query"""
+        with get_session() as session:
+            return self._get_portfolio_with_holdings(session, portfolio_id)
+
+    def _get_portfolio_with_holdings(self, session: Session, portfolio_id: int) -> Optional[Portfolio]:
+        """Load a portfolio and its holdings within an existing session"""
+        statement = (
+            select(Portfolio)
+            .where(Portfolio.id == portfolio_id)
+            .options(selectinload(Portfolio.holdings).raiseload("*"))  # type: ignore[arg-type]
+        )
+        return session.exec(statement).first()
+
+    async def get_holdings_with_metrics(
+        self,
+        portfolio_id: int,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        sort_by: str = "symbol",
+        descending: bool = False,
+    ) -> List[HoldingWithMetrics]:
         """Get holdings with calculated metrics including current prices"""
-        holdings = self.get_portfolio_holdings(portfolio_id)
-
-        if not holdings:
-            return []
-
-        # Get current prices for all symbols
-        symbols = [h.symbol for h in holdings]
-        prices = await price_service.get_multiple_prices(symbols)
+        holdings = await asyncio.to_thread(self._get_holding_rows, portfolio_id, offset, limit, sort_by, descending)
+        return await self._calculate_metrics(holdings)
+
+    async def get_holdings_batch(
+        self,
+        portfolio_id: int,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        sort_by: str = "symbol",
+        descending: bool = False,
+    ) -> HoldingsBatch:
+        """Get holdings with calculated metrics as columnar arrays"""
+        holdings = await asyncio.to_thread(self._get_holding_rows, portfolio_id, offset, limit, sort_by, descending)
+        return await self._calculate_metrics_batch(holdings)
+
+    async def _calculate_metrics(self, holdings: List[Any]) -> List[HoldingWithMetrics]:
+        """Calculate metrics for already-loaded holdings using current prices"""
+        batch = await self._calculate_metrics_batch(holdings)
+        current_price = batch.values("current_price")
+        current_value = batch.values("current_value")
+        absolute_return = batch.values("absolute_return")
+        percentage_return = batch.values("percentage_return")
+        total_cost = batch.total_cost.tolist()
 
         holdings_with_metrics = []
-        for holding in holdings:
-            if holding.id is None:
-                continue
-
-            current_price = prices.get(holding.symbol)
-
-            # Calculate metrics
-            total_cost = holding.quantity * holding.purchase_price
-            current_value = None
-            absolute_return = None
-            percentage_return = None
-
-            if current_price is not None:
-                current_value = holding.quantity * current_price
-                absolute_return = current_value - total_cost
-                if total_cost > 0:
-                    percentage_return = (absolute_return / total_cost) * Decimal("100")
-
-            holding_with_metrics = HoldingWithMetrics(
+        for i, holding in enumerate(batch.holdings):
+            holding_with_metrics = HoldingWithMetrics.model_construct(
+                _fields_set=_METRICS_FIELDS_SET.copy(),
                 id=holding.id,
                 portfolio_id=holding.portfolio_id,
                 symbol=holding.symbol,
@@ -179,78 +361,155 @@ class PortfolioService:
                 notes=holding.notes,
                 created_at=holding.created_at,
                 updated_at=holding.updated_at,
-                current_price=current_price,
-                current_value=current_value,
-                total_cost=total_cost,
-                absolute_return=absolute_return,
-                percentage_return=percentage_return,
-                last_updated=datetime.now(),
+                current_price=current_price[i],
+                current_value=current_value[i],
+                total_cost=total_cost[i],
+                absolute_return=absolute_return[i],
+                percentage_return=percentage_return[i],
+                last_updated=batch.last_updated,
             )
             holdings_with_metrics.append(holding_with_metrics)
 
         return holdings_with_metrics
 
+    async def _calculate_metrics_batch(self, holdings: List[Any], stored_prices: bool = False) -> HoldingsBatch:
+        """Calculate metrics for already-loaded holdings as columnar arrays, optionally from fresh stored prices"""
+        holdings = [h for h in holdings if h.id is not None]
+
+        # Get current prices for all distinct symbols in one batch
+        symbols = list(dict.fromkeys(h.symbol for h in holdings))
+        get_prices = self._get_summary_prices if stored_prices else self._get_prices
+        prices = await get_prices(symbols) if symbols else {}
+
+        # Calculate metrics in one vectorized pass; missing prices propagate as NaN
+        quantity = np.asarray([h.quantity for h in holdings], dtype=np.float64)
+        purchase_price = np.asarray([h.purchase_price for h in holdings], dtype=np.float64)
+        current_price = np.asarray(
+            [np.nan if prices.get(h.symbol) is None else prices[h.symbol] for h in holdings], dtype=np.float64
+        )
+
+        total_cost = quantity * purchase_price
+        current_value = quantity * current_price
+        absolute_return = current_value - total_cost
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percentage_return = np.where(total_cost > 0, absolute_return / total_cost * 100.0, np.nan)
+
+        return HoldingsBatch(
+            holdings=holdings,
+            quantity=quantity,
+            purchase_price=purchase_price,
+            current_price=current_price,
+            total_cost=total_cost,
+            current_value=current_value,
+            absolute_return=absolute_return,
+            percentage_return=percentage_return,
+            last_updated=utc_now(),
+        )
+
     async def get_portfolio_summary(self, portfolio_id: int) -> Optional[PortfolioSummary]:
-        """Get portfolio summary with aggregated metrics"""
-        portfolio = self.get_portfolio(portfolio_id)
+        """Get portfolio summary, served from the summary cache while it is clean and fresh"""
+        cached, portfolio, version = await asyncio.to_thread(self._load_summary_inputs, portfolio_id)
+        if cached is not None:
+            return cached
         if portfolio is None:
             return None
 
-        holdings_with_metrics = await self.get_holdings_with_metrics(portfolio_id)
+        # Prices fetched for this summary are written to price history without marking this summary dirty
+        token = summary_in_progress.set(portfolio_id)
+        try:
+            summary = await self._compute_portfolio_summary(portfolio_id, portfolio)
+        finally:
+            summary_in_progress.reset(token)
+        await asyncio.to_thread(self._store_summary, summary, version)
+        return summary
+
+    def _load_summary_inputs(self, portfolio_id: int) -> Tuple[Optional[PortfolioSummary], Optional[Portfolio], int]:
+        """Get the clean cached summary, or else the portfolio with holdings and the cache version to compute from"""
+        with get_session() as session:
+            cached = session.get(PortfolioSummaryCache, portfolio_id)
+            if (
+                cached is not None
+                and not cached.is_dirty
+                and (utc_now() - cached.last_updated).total_seconds() < _SUMMARY_CACHE_TTL
+            ):
+                return PortfolioSummary.model_construct(**cached.model_dump(exclude={"is_dirty", "version"})), None, 0
+
+            if cached is None:
+                cached = self._create_summary_row(session, portfolio_id)
+                if cached is None:
+                    return None, None, 0
+
+            # Load the portfolio in the same session; prices are fetched after it is released
+            return None, self._get_portfolio_with_holdings(session, portfolio_id), cached.version
+
+    def _create_summary_row(self, session: Session, portfolio_id: int) -> Optional[PortfolioSummaryCache]:
+        """Insert a dirty summary row, so holding writes during the first computation bump its version"""
+        portfolio = session.get(Portfolio, portfolio_id)
+        if portfolio is None:
+            return None
 
-        if not holdings_with_metrics:
+        try:
+            session.add(PortfolioSummaryCache(portfolio_id=portfolio_id, portfolio_name=portfolio.name, is_dirty=True))
+            session.commit()
+        except IntegrityError:
+            # Another client computing the same summary created the row first
+            session.rollback()
+        return session.get(PortfolioSummaryCache, portfolio_id)
+
+    def _store_summary(self, summary: PortfolioSummary, version: int) -> None:
+        """Store a freshly computed summary unless the cache was marked dirty since its inputs were read"""
+        with get_session() as session:
+            statement = (
+                update(PortfolioSummaryCache)
+                .where(col(PortfolioSummaryCache.portfolio_id) == summary.portfolio_id)
+                .where(col(PortfolioSummaryCache.version) == version)
+                .values(**summary.model_dump(exclude={"portfolio_id"}), is_dirty=False)
+            )
+            session.exec(statement)  # type: ignore[call-overload]
+            session.commit()
+
+    async def _compute_portfolio_summary(self, portfolio_id: int, portfolio: Portfolio) -> PortfolioSummary:
+        """Compute portfolio summary with aggregated metrics"""
+        batch = await self._calculate_metrics_batch(portfolio.holdings, stored_prices=True)
+
+        if not batch:
             return PortfolioSummary(
                 portfolio_id=portfolio_id,
                 portfolio_name=portfolio.name,
                 total_holdings=0,
-                total_cost=Decimal("0"),
-                total_current_value=Decimal("0"),
-                total_absolute_return=Decimal("0"),
-                total_percentage_return=Decimal("0"),
-                last_updated=datetime.now(),
+                total_cost=0.0,
+                total_current_value=0.0,
+                total_absolute_return=0.0,
+                total_percentage_return=0.0,
+                last_updated=utc_now(),
             )
 
-        # Calculate aggregated metrics
-        total_cost = Decimal("0")
-        total_current_value = Decimal("0")
-
-        for h in holdings_with_metrics:
-            if h.total_cost is not None:
-                total_cost += h.total_cost
-            if h.current_value is not None:
-                total_current_value += h.current_value
+        # Calculate aggregated metrics; holdings without a current price add nothing to the current value
+        total_cost = float(batch.total_cost.sum())
+        total_current_value = float(np.nansum(batch.current_value))
 
         total_absolute_return = total_current_value - total_cost
-        total_percentage_return = (
-            (total_absolute_return / total_cost * Decimal("100")) if total_cost > 0 else Decimal("0")
-        )
+        total_percentage_return = (total_absolute_return / total_cost * 100.0) if total_cost > 0 else 0.0
 
-        # Find best and worst performers
+        # Find best and worst performers, ignoring holdings without a return
         best_performer = None
         worst_performer = None
-        best_return = None
-        worst_return = None
-
-        for holding in holdings_with_metrics:
-            if holding.percentage_return is not None:
-                if best_return is None or holding.percentage_return > best_return:
-                    best_return = holding.percentage_return
-                    best_performer = holding.symbol
-                if worst_return is None or holding.percentage_return < worst_return:
-                    worst_return = holding.percentage_return
-                    worst_performer = holding.symbol
+        returns = batch.percentage_return
+        if not np.isnan(returns).all():
+            best_performer = batch.holdings[int(np.nanargmax(returns))].symbol
+            worst_performer = batch.holdings[int(np.nanargmin(returns))].symbol
 
         return PortfolioSummary(
             portfolio_id=portfolio_id,
             portfolio_name=portfolio.name,
-            total_holdings=len(holdings_with_metrics),
+            total_holdings=len(batch),
             total_cost=total_cost,
             total_current_value=total_current_value,
             total_absolute_return=total_absolute_return,
             total_percentage_return=total_percentage_return,
             best_performer=best_performer,
             worst_performer=worst_performer,
-            last_updated=datetime.now(),
+            last_updated=utc_now(),
         )
 
 
@@ -1,128 +1,367 @@
 import yfinance as yf
 import asyncio
+import math
+import threading
+from collections import OrderedDict
+from asyncio_throttle.throttler import Throttler
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
 from decimal import Decimal
-from datetime import datetime
-from typing import Dict, Optional, List
-from sqlmodel import select
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, List
+from curl_cffi import requests as curl_requests
+from sqlalchemy import bindparam
+from sqlmodel import Session, col, delete, desc, func, select, update
 from app.database import get_session
-from app.models import PriceHistory, PriceData
+from app.models import Holding, PortfolioSummaryCache, PriceHistory, PriceData, Symbol, utc_now
 
 
-# Simple throttler implementation
-class SimpleThrottler:
-    def __init__(self, rate_limit: int, period: int):
-        self.rate_limit = rate_limit
-        self.period = period
+# One HTTP session for every yfinance call. yfinance keeps a single process-wide YfData (one session and cookie
+# shared by all threads) and swaps in whatever session a call passes, so handing it the same object keeps the Yahoo
+# cookie and crumb it already negotiated instead of replacing them on each call. yfinance only accepts curl_cffi
+# sessions.
+_SESSION = curl_requests.Session(impersonate="chrome")
 
-    async def __aenter__(self):
-        return self
 
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        pass
+# yf.download collects results in module globals that every call resets, so overlapping batch downloads from
+# different executor threads would drop or mix up each other's tickers
+_DOWNLOAD_LOCK = threading.Lock()
+
+
+# Portfolio whose summary the current task is computing. Prices it fetches go into that very summary, so storing
+# them must not mark it dirty and discard the result; summaries of other holders are still invalidated.
+summary_in_progress: ContextVar[Optional[int]] = ContextVar("summary_in_progress", default=None)
+
+
+# Latest stored price for one ticker; built once so each fallback lookup only binds the symbol
+_LAST_PRICE_STATEMENT = (
+    select(col(PriceHistory.price))
+    .join(Symbol)
+    .where(col(Symbol.ticker) == bindparam("symbol"))
+    .order_by(desc(col(PriceHistory.timestamp)), desc(col(PriceHistory.id)))
+    .limit(1)
+)
+
+
+def _fast_info_value(fast_info: Any, attribute: str) -> Optional[Decimal]:
+    """Read a numeric fast_info attribute as a Decimal, or None when it is missing or not a finite number"""
+    try:
+        value = getattr(fast_info, attribute)
+    except Exception:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        return None
+    return Decimal(str(value))
+
+
+def _download_closes(symbols: List[str]) -> Any:
+    """Download the latest daily bars of several symbols, one batch at a time; blocking, runs in the price executor"""
+    with _DOWNLOAD_LOCK:
+        return yf.download(symbols, period="1d", group_by="ticker", progress=False, threads=True, session=_SESSION)
+
+
+def _fetch_ticker_price(symbol: str) -> Optional[Decimal]:
+    """Look up the latest price of one symbol from yfinance; blocking, runs in the price executor"""
+    ticker = yf.Ticker(symbol, session=_SESSION)
+
+    # fast_info needs one light quote request instead of the full quoteSummary behind ticker.info
+    price = _fast_info_value(ticker.fast_info, "last_price")
+    if price is not None:
+        return price
+
+    info = ticker.info
+
+    # Try different price fields
+    for field in ["currentPrice", "regularMarketPrice", "price", "lastPrice"]:
+        if field in info and info[field] is not None:
+            return Decimal(str(info[field]))
+
+    # Fallback to history if info doesn't have price
+    hist = ticker.history(period="1d")
+    if not hist.empty:
+        return Decimal(str(hist["Close"].iloc[-1]))
+    return None
+
+
+class PriceCache(OrderedDict):
+    """Least-recently-used cache of (price, fetched_at) entries bounded to maxsize symbols"""
+
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __setitem__(self, symbol: str, entry: tuple[Decimal, datetime]) -> None:
+        super().__setitem__(symbol, entry)
+        self.move_to_end(symbol)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
 
 
 class PriceService:
     def __init__(self):
-        # Rate limiting: max 10 requests per minute to avoid API limits
-        self.throttler = SimpleThrottler(rate_limit=10, period=60)
-        self._price_cache: Dict[str, tuple[Decimal, datetime]] = {}
+        # Rate limiting: max 10 requests per minute to avoid API limits; waiters re-check every 100ms
+        self.throttler = Throttler(rate_limit=10, period=60, retry_interval=0.1)
+        self._price_cache = PriceCache(maxsize=10_000)
         self._cache_duration = 300  # 5 minutes cache
+        # Dedicated pool for blocking yfinance calls, so price lookups cannot crowd out the default executor
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="price")
+        # Downloads in progress, so concurrent callers wait for them instead of fetching the same symbols again
+        self._pending: Dict[str, asyncio.Future[Dict[str, Decimal]]] = {}
 
     async def get_current_price(self, symbol: str) -> Optional[Decimal]:
         """Get current price for a symbol with caching and rate limiting"""
+        try:
+            return await self._fetch_price(symbol)
+        except Exception as e:
+            print(f"Error fetching price for {symbol}: {e}")
+            # Try to get last known price from database
+            return await self._get_last_known_price(symbol)
+
+    async def _fetch_price(self, symbol: str) -> Optional[Decimal]:
+        """Get current price from cache or yfinance, raising on fetch errors"""
         # Check cache first
-        if symbol in self._price_cache:
-            cached_price, cached_time = self._price_cache[symbol]
-            if (datetime.now() - cached_time).total_seconds() < self._cache_duration:
-                return cached_price
+        cached_price = self._get_cached_price(symbol)
+        if cached_price is not None:
+            return cached_price
 
-        # Rate limit the API call
-        async with self.throttler:
-            try:
-                # Run yfinance in thread pool to avoid blocking
-                loop = asyncio.get_event_loop()
-                ticker = await loop.run_in_executor(None, yf.Ticker, symbol)
-                info = await loop.run_in_executor(None, lambda: ticker.info)
-
-                # Try different price fields
-                price = None
-                for field in ["currentPrice", "regularMarketPrice", "price", "lastPrice"]:
-                    if field in info and info[field] is not None:
-                        price = Decimal(str(info[field]))
-                        break
-
-                if price is None:
-                    # Fallback to history if info doesn't have price
-                    hist = await loop.run_in_executor(None, lambda: ticker.history(period="1d"))
-                    if not hist.empty:
-                        price = Decimal(str(hist["Close"].iloc[-1]))
+        # Wait for a download of this symbol already in progress instead of fetching it again
+        if symbol in self._pending:
+            fetched = await asyncio.shield(self._pending[symbol])
+            if symbol not in fetched:
+                raise LookupError("concurrent download returned no price")
+            return fetched[symbol]
+
+        loop = asyncio.get_running_loop()
+        download = loop.create_future()
+        self._pending[symbol] = download
+        fetched: Dict[str, Decimal] = {}
+        try:
+            # Rate limit the API call
+            async with self.throttler:
+                # Run all yfinance steps in one executor job to avoid blocking
+                price = await loop.run_in_executor(self._executor, _fetch_ticker_price, symbol)
 
                 if price is not None:
                     # Cache the result
-                    self._price_cache[symbol] = (price, datetime.now())
+                    fetched_at = utc_now()
+                    self._price_cache[symbol] = (price, fetched_at)
+                    fetched = {symbol: price}
 
                     # Store in database for historical tracking
-                    await self._store_price_history(symbol, price)
+                    await self._store_price_history(fetched, fetched_at)
+
+            return price
+        finally:
+            self._pending.pop(symbol, None)
+            download.set_result(fetched)
 
-                    return price
+    async def get_multiple_prices(self, symbols: List[str]) -> Dict[str, Optional[Decimal]]:
+        """Get prices for multiple symbols, downloading all cache misses in one batch"""
+        price_dict: Dict[str, Optional[Decimal]] = {}
+        misses = []
+        pending = {}
+        now = utc_now()
+        for symbol in dict.fromkeys(symbols):
+            cached_price = self._get_cached_price(symbol, now)
+            if cached_price is not None:
+                price_dict[symbol] = cached_price
+            elif symbol in self._pending:
+                pending[symbol] = self._pending[symbol]
+            else:
+                misses.append(symbol)
+
+        if not misses and not pending:
+            return price_dict
 
+        fetched: Dict[str, Decimal] = {}
+        if misses:
+            download = asyncio.get_running_loop().create_future()
+            self._pending.update(dict.fromkeys(misses, download))
+            try:
+                fetched = await self._fetch_batch(misses)
             except Exception as e:
-                print(f"Error fetching price for {symbol}: {e}")
-                # Try to get last known price from database
-                return await self._get_last_known_price(symbol)
+                print(f"Error fetching prices for {', '.join(misses)}: {e}")
+            finally:
+                for symbol in misses:
+                    self._pending.pop(symbol, None)
+                download.set_result(fetched)
 
-        return None
+        for symbol, download in pending.items():
+            result = await asyncio.shield(download)
+            if symbol in result:
+                fetched[symbol] = result[symbol]
+        price_dict.update(fetched)
 
-    async def get_multiple_prices(self, symbols: List[str]) -> Dict[str, Optional[Decimal]]:
-        """Get prices for multiple symbols concurrently"""
-        tasks = [self.get_current_price(symbol) for symbol in symbols]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-
-        price_dict = {}
-        for symbol, result in zip(symbols, results):
-            if isinstance(result, Exception):
-                print(f"Error fetching price for {symbol}: {result}")
-                price_dict[symbol] = None
-            else:
-                price_dict[symbol] = result
+        # Fall back to last known prices for all failed symbols in one query
+        failed = [symbol for symbol in [*misses, *pending] if symbol not in fetched]
+        if failed:
+            last_known = await self._get_last_known_prices(failed)
+            for symbol in failed:
+                price_dict[symbol] = last_known.get(symbol)
 
         return price_dict
 
-    async def _store_price_history(self, symbol: str, price: Decimal) -> None:
-        """Store price data in database for historical tracking"""
+    def _get_cached_price(self, symbol: str, now: Optional[datetime] = None) -> Optional[Decimal]:
+        """Get price from cache if it has not expired, evicting it if it has"""
+        entry = self._price_cache.get(symbol)
+        if entry is None:
+            return None
+
+        cached_price, cached_time = entry
+        if ((now or utc_now()) - cached_time).total_seconds() < self._cache_duration:
+            self._price_cache.move_to_end(symbol)
+            return cached_price
+
+        del self._price_cache[symbol]
+        return None
+
+    async def _fetch_batch(self, symbols: List[str]) -> Dict[str, Decimal]:
+        """Fetch latest prices for several symbols with a single yfinance download"""
+        async with self.throttler:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(self._executor, _download_closes, symbols)
+        if data is None or data.empty:
+            return {}
+
+        prices = {}
+        for symbol in symbols:
+            try:
+                closes = data[(symbol, "Close")].dropna()
+            except KeyError:
+                continue
+            if not closes.empty:
+                prices[symbol] = Decimal(str(closes.iloc[-1]))
+
+        # Cache the whole batch under one fetch time and store in database for historical tracking
+        fetched_at = utc_now()
+        self._price_cache.update((symbol, (price, fetched_at)) for symbol, price in prices.items())
+        if prices:
+            await self._store_price_history(prices, fetched_at)
+
+        return prices
+
+    async def _store_price_history(self, prices: Dict[str, Decimal], timestamp: Optional[datetime] = None) -> None:
+        """Store a batch of prices in database for historical tracking without blocking the event loop"""
+        await asyncio.to_thread(self._write_price_history, prices, timestamp or utc_now())
+
+    def _write_price_history(self, prices: Dict[str, Decimal], timestamp: datetime) -> None:
+        """Store a batch of prices in database for historical tracking with a single commit"""
         try:
             with get_session() as session:
-                price_record = PriceHistory(symbol=symbol, price=price, timestamp=datetime.now(), source="yfinance")
-                session.add(price_record)
+                symbol_ids = self._get_symbol_ids(session, list(prices))
+                session.add_all(
+                    [
+                        PriceHistory(symbol_id=symbol_ids[symbol], price=price, timestamp=timestamp, source="yfinance")
+                        for symbol, price in prices.items()
+                    ]
+                )
+
+                # New prices make cached summaries of portfolios holding these symbols stale
+                holders = select(Holding.portfolio_id).where(col(Holding.symbol).in_(prices))
+                statement = (
+                    update(PortfolioSummaryCache)
+                    .where(col(PortfolioSummaryCache.portfolio_id).in_(holders))
+                    .values(is_dirty=True, version=col(PortfolioSummaryCache.version) + 1)
+                )
+                computing = summary_in_progress.get()
+                if computing is not None:
+                    statement = statement.where(col(PortfolioSummaryCache.portfolio_id) != computing)
+                session.exec(statement)  # type: ignore[call-overload]
                 session.commit()
         except Exception as e:
-            print(f"Error storing price history for {symbol}: {e}")
+            print(f"Error storing price history for {', '.join(prices)}: {e}")
+
+    def _get_symbol_ids(self, session: Session, tickers: List[str]) -> Dict[str, int]:
+        """Get symbol ids for tickers, creating rows for tickers not seen before"""
+        statement = select(col(Symbol.ticker), col(Symbol.id)).where(col(Symbol.ticker).in_(tickers))
+        symbol_ids: Dict[str, int] = {
+            ticker: symbol_id for ticker, symbol_id in session.exec(statement) if symbol_id is not None
+        }
+
+        new_symbols = [Symbol(ticker=ticker) for ticker in dict.fromkeys(tickers) if ticker not in symbol_ids]
+        if new_symbols:
+            session.add_all(new_symbols)
+            session.flush()
+            for new_symbol in new_symbols:
+                # flush assigned the primary key
+                assert new_symbol.id is not None
+                symbol_ids[new_symbol.ticker] = new_symbol.id
+        return symbol_ids
 
     async def _get_last_known_price(self, symbol: str) -> Optional[Decimal]:
+        """Get last known price from database as fallback without blocking the event loop"""
+        return await asyncio.to_thread(self._read_last_known_price, symbol)
+
+    def _read_last_known_price(self, symbol: str) -> Optional[Decimal]:
         """Get last known price from database as fallback"""
         try:
             with get_session() as session:
-                from sqlmodel import desc
-
-                statement = (
-                    select(PriceHistory)
-                    .where(PriceHistory.symbol == symbol)
-                    .order_by(desc(PriceHistory.timestamp))
-                    .limit(1)
-                )
-
-                result = session.exec(statement).first()
-                if result:
-                    return result.price
+                result = session.exec(_LAST_PRICE_STATEMENT, params={"symbol": symbol}).first()
+                if result is not None:
+                    return result
         except Exception as e:
             print(f"Error getting last known price for {symbol}: {e}")
 
         return None
 
+    async def _get_last_known_prices(self, symbols: List[str]) -> Dict[str, Decimal]:
+        """Get last known prices for several symbols without blocking the event loop"""
+        return await asyncio.to_thread(self._read_last_known_prices, symbols)
+
+    def get_stored_prices(self, symbols: List[str], max_age: int) -> Dict[str, Decimal]:
+        """Get stored prices no older than max_age seconds, leaving out symbols without one"""
+        return self._read_last_known_prices(symbols, utc_now() - timedelta(seconds=max_age))
+
+    def _read_last_known_prices(self, symbols: List[str], since: Optional[datetime] = None) -> Dict[str, Decimal]:
+        """Get last known prices for several symbols from database in a single query, optionally only recent ones"""
+        try:
+            with get_session() as session:
+                # Newest row per ticker; the id breaks ties between rows stored under the same timestamp
+                newest_first = (desc(col(PriceHistory.timestamp)), desc(col(PriceHistory.id)))
+                ranked = (
+                    select(
+                        col(Symbol.ticker),
+                        col(PriceHistory.price),
+                        func.row_number()
+                        .over(partition_by=col(PriceHistory.symbol_id), order_by=newest_first)
+                        .label("rank"),
+                    )
+                    .join(Symbol)
+                    .where(col(Symbol.ticker).in_(symbols))
+                )
+                if since is not None:
+                    ranked = ranked.where(col(PriceHistory.timestamp) >= since)
+                ranked = ranked.subquery()
+                statement = select(ranked.c.ticker, ranked.c.price).where(ranked.c.rank == 1)
+                return {symbol: price for symbol, price in session.exec(statement)}
+        except Exception as e:
+            print(f"Error getting last known prices for {', '.join(symbols)}: {e}")
+
+        return {}
+
     def get_price_data(self, symbol: str) -> Optional[PriceData]:
         """Get detailed price data for a symbol"""
         try:
-            ticker = yf.Ticker(symbol)
+            ticker = yf.Ticker(symbol, session=_SESSION)
+
+            # Prefer the light fast_info quote, keeping the full info lookup as a fallback
+            fast_info = ticker.fast_info
+            price = _fast_info_value(fast_info, "last_price")
+            if price is not None:
+                try:
+                    currency = fast_info.currency
+                except Exception:
+                    currency = None
+                return PriceData(
+                    symbol=symbol,
+                    price=price,
+                    timestamp=utc_now(),
+                    source="yfinance",
+                    currency=currency if isinstance(currency, str) else "USD",
+                    market_cap=_fast_info_value(fast_info, "market_cap") or None,
+                    volume=_fast_info_value(fast_info, "last_volume") or None,
+                )
+
             info = ticker.info
 
             # Get current price
@@ -138,7 +377,7 @@ class PriceService:
             return PriceData(
                 symbol=symbol,
                 price=price,
-                timestamp=datetime.now(),
+                timestamp=utc_now(),
                 source="yfinance",
                 currency=info.get("currency", "USD"),
                 market_cap=Decimal(str(info["marketCap"])) if info.get("marketCap") else None,
@@ -149,6 +388,19 @@ class PriceService:
             print(f"Error getting price data for {symbol}: {e}")
             return None
 
+    def prune_price_history(self, days: int = 30) -> int:
+        """Delete price history older than the given number of days, returning the number of rows removed"""
+        cutoff = utc_now() - timedelta(days=days)
+        try:
+            with get_session() as session:
+                statement = delete(PriceHistory).where(col(PriceHistory.timestamp) < cutoff)
+                result = session.exec(statement)  # type: ignore[call-overload]
+                session.commit()
+                return result.rowcount
+        except Exception as e:
+            print(f"Error pruning price history: {e}")
+            return 0
+
     def clear_cache(self) -> None:
         """Clear the price cache"""
         self._price_cache.clear()
@@ -1,11 +1,30 @@
+import asyncio
 from app.database import create_tables
-from nicegui import app
+from app.portfolio_service import portfolio_service
+from app.price_service import price_service
+from nicegui import app, background_tasks
 import app.portfolio_dashboard
 
+# Number of most held symbols whose prices are loaded into the cache at startup
+PREWARM_SYMBOLS = 20
+
+
+async def prewarm_prices() -> None:
+    """Load prices of the most held symbols into the price cache before the first dashboard visit"""
+    symbols = await asyncio.to_thread(portfolio_service.get_popular_symbols, PREWARM_SYMBOLS)
+    if symbols:
+        await price_service.get_multiple_prices(symbols)
+
 
 def startup() -> None:
     # this function is called before the first request
     create_tables()
 
+    # Keep price history bounded; every price fetch appends rows
+    price_service.prune_price_history(days=30)
+
+    # Warm the price cache in the background so startup is not held up by yfinance
+    background_tasks.create(prewarm_prices(), name="prewarm_prices")
+
     # Register dashboard module
     app.portfolio_dashboard.create()
@@ -1,12 +1,122 @@
-from typing import Generator
+import os
+import threading
+from contextlib import contextmanager
+from typing import Generator, Iterator
 import pytest
-from app.startup import startup
-from nicegui.testing import User
+from sqlalchemy import create_engine, make_url, text
+
+
+def _worker_database_url(url: str, worker: str) -> str:
+    """Database URL for one xdist worker, so parallel workers never reset each other's tables"""
+    database_url = make_url(url)
+    if database_url.get_backend_name() == "sqlite":
+        if database_url.database in (None, "", ":memory:"):
+            return url
+        stem, dot, suffix = database_url.database.rpartition(".")
+        name = f"{stem}_{worker}.{suffix}" if dot else f"{suffix}_{worker}"
+        return database_url.set(database=name).render_as_string(hide_password=False)
+
+    name = f"{database_url.database}_{worker}"
+    admin_engine = create_engine(database_url, isolation_level="AUTOCOMMIT")
+    with admin_engine.connect() as conn:
+        if conn.execute(text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": name}).first() is None:
+            conn.execute(text(f'CREATE DATABASE "{name}"'))
+    admin_engine.dispose()
+    return database_url.set(database=name).render_as_string(hide_password=False)
+
+
+# Tests run against in-memory SQLite unless APP_TEST_DATABASE_URL names another database. Each xdist worker
+# process gets its own memory database; other databases are routed per worker before app.database builds the engine
+os.environ["APP_DATABASE_URL"] = os.environ.get("APP_TEST_DATABASE_URL", "sqlite://")
+if "PYTEST_XDIST_WORKER" in os.environ:
+    os.environ["APP_DATABASE_URL"] = _worker_database_url(
+        os.environ["APP_DATABASE_URL"], os.environ["PYTEST_XDIST_WORKER"]
+    )
+
+from unittest.mock import patch  # noqa: E402
+from sqlalchemy import Connection, event  # noqa: E402
+from sqlmodel import Session  # noqa: E402
+from app.database import ENGINE, fast_reset_db, reset_db  # noqa: E402
+from app.startup import startup  # noqa: E402
+from nicegui.testing import User  # noqa: E402
 
 pytest_plugins = ['nicegui.testing.plugin']
 
+if ENGINE.dialect.name == "sqlite":
+
+    @event.listens_for(ENGINE, "connect")
+    def _fast_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        # Test data is thrown away, so skip fsyncs and keep journals and temp tables in memory. Locking stays
+        # normal because UI tests open several connections to a file database
+        cursor = dbapi_connection.cursor()
+        for pragma in ("synchronous=OFF", "journal_mode=MEMORY", "temp_store=MEMORY"):
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addoption("--skip-slow", action="store_true", default=False, help="skip tests marked as slow")
+
+
+def pytest_collection_modifyitems(config: pytest.Config, items: list[pytest.Item]) -> None:
+    if not config.getoption("--skip-slow"):
+        return
+    skip_slow = pytest.mark.skip(reason="--skip-slow given")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip_slow)
+
 
 @pytest.fixture
 def user(user: User) -> Generator[User, None, None]:
     startup()
+    # UI tests commit through the real engine, so each one starts from empty tables
+    fast_reset_db()
     yield user
+
+
+@pytest.fixture(scope="session")
+def db_schema() -> None:
+    """Create all tables once for the whole test session"""
+    reset_db()
+
+
+@pytest.fixture(scope="module")
+def db_connection(db_schema: None) -> Generator[Connection, None, None]:
+    """Route every session of a test module through one connection whose transaction is rolled back afterwards"""
+    connection = ENGINE.connect()
+    if ENGINE.dialect.name == "sqlite":
+        # pysqlite defers BEGIN and breaks SAVEPOINT, so this connection issues its transaction statements itself
+        connection.execution_options(isolation_level="AUTOCOMMIT")
+        transaction = connection.begin()
+        connection.exec_driver_sql("BEGIN")
+    else:
+        transaction = connection.begin()
+
+    # Services open sessions from worker threads too (asyncio.to_thread), and the shared connection can only
+    # nest one stack of SAVEPOINTs at a time, so sessions take turns
+    lock = threading.RLock()
+
+    @contextmanager
+    def get_session() -> Iterator[Session]:
+        # Each service session works in a SAVEPOINT, so its commits and rollbacks stay inside the test transaction
+        with lock, Session(bind=connection, join_transaction_mode="create_savepoint") as session:
+            yield session
+
+    with (
+        patch("app.database.get_session", get_session),
+        patch("app.portfolio_service.get_session", get_session),
+        patch("app.price_service.get_session", get_session),
+    ):
+        yield connection
+
+    transaction.rollback()
+    connection.close()
+
+
+@pytest.fixture
+def new_db(db_connection: Connection) -> Generator[None, None, None]:
+    """Run the test inside a SAVEPOINT that is rolled back afterwards, keeping module-level rows"""
+    savepoint = db_connection.begin_nested()
+    yield
+    savepoint.rollback()
@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+from types import MethodType
+from typing import AsyncIterator, Callable
+from unittest.mock import MagicMock
+from nicegui import ui
+from nicegui.events import GenericEventArguments, handle_event
+from nicegui.testing import User
+from app.database import fast_reset_db
+from app.models import PortfolioCreate
+from app.portfolio_dashboard import PortfolioDashboard
+from app.portfolio_service import portfolio_service
+from app.startup import startup
+
+
+@pytest.fixture
+async def create_user(create_user: Callable[[], User]) -> AsyncIterator[Callable[[], User]]:
+    startup()
+    # Dashboard pages commit through the real engine, so each test starts from empty tables
+    fast_reset_db()
+    yield create_user
+
+    # Refreshes are plain tasks on the shared event loop; let them finish so they cannot query during later tests
+    refreshes = [dashboard._refresh_task for dashboard in PortfolioDashboard._open_dashboards]
+    await asyncio.gather(*(task for task in refreshes if task is not None))
+
+
+async def open_dashboard(user: User) -> PortfolioDashboard:
+    """Open the dashboard page for one simulated client and return that client's dashboard"""
+    await user.open("/")
+    timer = user.find(ui.timer).elements.pop()
+    # The auto-refresh timer calls a method of the dashboard that built the page
+    assert isinstance(timer.callback, MethodType)
+    dashboard = timer.callback.__self__
+    assert isinstance(dashboard, PortfolioDashboard)
+    return dashboard
+
+
+async def test_each_client_gets_its_own_dashboard(create_user: Callable[[], User]):
+    """Test refresh state is not shared between browser clients"""
+    first = await open_dashboard(create_user())
+    second = await open_dashboard(create_user())
+
+    assert first is not second
+    assert first.refresh_timer is not second.refresh_timer
+    assert first.holdings_table is not second.holdings_table
+
+
+def emit_page_event(dashboard: PortfolioDashboard, event_type: str) -> None:
+    """Deliver a page-level event, as emitted by the browser, to the client owning the dashboard"""
+    assert dashboard.refresh_timer is not None
+    client = dashboard.refresh_timer.client
+    # NiceGUI stores event names camel-cased, e.g. "dashboard-hidden" as "dashboardHidden"
+    name = event_type.replace("-", "").lower()
+    for listener in client.layout._event_listeners.values():
+        if listener.type.lower() == name:
+            handle_event(listener.handler, GenericEventArguments(sender=client.layout, client=client, args=None))
+
+
+async def test_hidden_tab_pauses_only_its_own_timer(create_user: Callable[[], User]):
+    """Test hiding one client's tab leaves other clients' auto-refresh running"""
+    hidden = await open_dashboard(create_user())
+    visible = await open_dashboard(create_user())
+    assert hidden.refresh_timer is not None and visible.refresh_timer is not None
+
+    emit_page_event(hidden, "dashboard-hidden")
+
+    assert not hidden.refresh_timer.active
+    assert visible.refresh_timer.active
+
+    emit_page_event(hidden, "dashboard-visible")
+
+    assert hidden.refresh_timer.active
+
+
+async def test_new_portfolio_appears_in_every_client_selector(create_user: Callable[[], User]):
+    """Test a portfolio created in one client is pushed to other clients' selectors"""
+    creator = await open_dashboard(create_user())
+    other = await open_dashboard(create_user())
+    assert creator.refresh_timer is not None and creator.portfolio_selector is not None
+    assert other.portfolio_selector is not None
+
+    with creator.refresh_timer.client:
+        creator.create_portfolio(MagicMock(), "Shared Portfolio", "")
+
+    assert creator.current_portfolio_id is not None
+    assert creator.portfolio_selector.value == creator.current_portfolio_id
+    assert other.portfolio_selector.options[creator.current_portfolio_id] == "Shared Portfolio"
+    assert other.current_portfolio_id is None
+
+
+async def test_page_request_during_refresh_is_kept(create_user: Callable[[], User], monkeypatch):
+    """Test a refresh in flight does not overwrite a page or sort change made while it awaited data"""
+    dashboard = await open_dashboard(create_user())
+    assert dashboard.holdings_table is not None
+    table = dashboard.holdings_table
+    dashboard.current_portfolio_id = portfolio_service.create_portfolio(PortfolioCreate(name="Paged")).id
+    get_holdings_batch = portfolio_service.get_holdings_batch
+
+    async def batch_with_sort_change(*args, **kwargs):
+        # The user sorts by quantity while the refresh is loading the symbol-sorted page
+        table.pagination = {**table.pagination, "sortBy": "quantity"}
+        return await get_holdings_batch(*args, **kwargs)
+
+    monkeypatch.setattr(portfolio_service, "get_holdings_batch", batch_with_sort_change)
+    with table.client:
+        await dashboard.refresh_holdings_table()
+
+    assert table.pagination["sortBy"] == "quantity"
@@ -1,412 +1,665 @@
+import pandas as pd
 import pytest
+from datetime import timedelta
 from decimal import Decimal
-from unittest.mock import patch
+from unittest.mock import AsyncMock, MagicMock, patch
+from pydantic import ValidationError
+from sqlalchemy import event
+from app.database import ENGINE
 from app.portfolio_service import PortfolioService
-from app.models import PortfolioCreate, PortfolioUpdate, HoldingCreate, HoldingUpdate, AssetType
-from app.database import reset_db
+from app.price_service import PriceCache, price_service
+from app.models import PortfolioCreate, PortfolioUpdate, HoldingCreate, HoldingUpdate, AssetType, utc_now
+
+# Amounts shared by many tests, parsed once
+QTY_1 = Decimal("1.0")
+QTY_5 = Decimal("5.0")
+QTY_10 = Decimal("10.0")
+PRICE_100 = Decimal("100.0")
+PRICE_150 = Decimal("150.0")
+PRICE_160 = Decimal("160.0")
+PRICE_2700 = Decimal("2700.0")
+PRICE_2800 = Decimal("2800.0")
+PRICE_2900 = Decimal("2900.0")
+
+# (symbol, quantity, purchase_price) of the holdings shared by the metric and summary tests
+DEFAULT_HOLDINGS = (("AAPL", QTY_10, PRICE_150), ("GOOGL", QTY_5, PRICE_2800))
+
+
+def make_holding(
+    portfolio_id: int, symbol: str = "AAPL", quantity: Decimal = QTY_10, purchase_price: Decimal = PRICE_150, **fields
+) -> HoldingCreate:
+    """Build holding data, defaulting to 10 AAPL bought at 150"""
+    return HoldingCreate(
+        portfolio_id=portfolio_id, symbol=symbol, quantity=quantity, purchase_price=purchase_price, **fields
+    )
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def portfolio_service():
     return PortfolioService()
 
 
-@pytest.fixture
-def new_db():
-    reset_db()
-    yield
-    reset_db()
+@pytest.fixture(scope="module")
+def base_portfolio(db_connection, portfolio_service):
+    """Create the sample portfolio once per module, outside the per-test savepoints"""
+    portfolio_data = PortfolioCreate(name="Test Portfolio", description="A test portfolio")
+    return portfolio_service.create_portfolio(portfolio_data)
 
 
 @pytest.fixture
-def sample_portfolio(new_db, portfolio_service):
-    """Create a sample portfolio for testing"""
+def sample_portfolio(new_db, base_portfolio):
+    """Sample portfolio for testing; changes made by the test are rolled back with its savepoint"""
+    return base_portfolio
+
+
+@pytest.fixture(scope="module")
+def base_holding(db_connection, portfolio_service):
+    """Create the sample holding once per module, in its own portfolio so the sample portfolio starts empty"""
     portfolio_data = PortfolioCreate(name="Test Portfolio", description="A test portfolio")
-    return portfolio_service.create_portfolio(portfolio_data)
+    holding_data = make_holding(portfolio_service.create_portfolio(portfolio_data).id, notes="Test holding")
+    return portfolio_service.add_holding(holding_data)
+
+
+@pytest.fixture
+def sample_holding(new_db, base_holding):
+    """Sample holding for testing; updating or deleting it is rolled back with the test's savepoint"""
+    return base_holding
 
 
 @pytest.fixture
-def sample_holding(sample_portfolio, portfolio_service):
-    """Create a sample holding for testing"""
+def bulk_holdings_factory(new_db, portfolio_service):
+    """Insert several holdings with one add_holdings call instead of one add_holding call each"""
+    return lambda specs: portfolio_service.add_holdings(list(specs))
+
+
+@pytest.fixture(scope="module")
+def holdings_with_prices(request, db_connection, portfolio_service):
+    """Portfolio holding the parametrized holding set, built once per module; tests mock the current prices"""
+    portfolio = portfolio_service.create_portfolio(PortfolioCreate(name="Metrics Portfolio"))
+    portfolio_service.add_holdings([make_holding(portfolio.id, *spec) for spec in request.param])
+    return portfolio
+
+
+@pytest.fixture
+def no_portfolios(new_db, portfolio_service):
+    """Start from empty tables; the module's sample rows return when the savepoint rolls back"""
+    for portfolio in portfolio_service.get_all_portfolios():
+        portfolio_service.delete_portfolio(portfolio.id)
+
+
+def test_create_portfolio(portfolio_service, new_db):
+    """Test creating a new portfolio"""
+    portfolio_data = PortfolioCreate(name="My Portfolio", description="Investment portfolio")
+
+    portfolio = portfolio_service.create_portfolio(portfolio_data)
+
+    assert portfolio.id is not None
+    assert portfolio.name == "My Portfolio"
+    assert portfolio.description == "Investment portfolio"
+    assert portfolio.created_at is not None
+    assert portfolio.updated_at is not None
+
+
+def test_create_portfolio_minimal(portfolio_service, new_db):
+    """Test creating portfolio with minimal data"""
+    portfolio_data = PortfolioCreate(name="Simple Portfolio")
+
+    portfolio = portfolio_service.create_portfolio(portfolio_data)
+
+    assert portfolio.id is not None
+    assert portfolio.name == "Simple Portfolio"
+    assert portfolio.description == ""
+
+
+def test_get_portfolio_exists(portfolio_service, sample_portfolio):
+    """Test getting an existing portfolio"""
+    portfolio = portfolio_service.get_portfolio(sample_portfolio.id)
+
+    assert portfolio is not None
+    assert portfolio.id == sample_portfolio.id
+    assert portfolio.name == sample_portfolio.name
+
+
+def test_get_portfolio_not_exists(portfolio_service, new_db):
+    """Test getting non-existent portfolio"""
+    portfolio = portfolio_service.get_portfolio(999)
+
+    assert portfolio is None
+
+
+def test_get_all_portfolios(portfolio_service, no_portfolios):
+    """Test getting all portfolios"""
+    # Create multiple portfolios
+    portfolio_service.create_portfolio(PortfolioCreate(name="Portfolio 1"))
+    portfolio_service.create_portfolio(PortfolioCreate(name="Portfolio 2"))
+
+    portfolios = portfolio_service.get_all_portfolios()
+
+    assert len(portfolios) == 2
+    portfolio_names = [p.name for p in portfolios]
+    assert "Portfolio 1" in portfolio_names
+    assert "Portfolio 2" in portfolio_names
+
+
+def test_get_all_portfolios_empty(portfolio_service, no_portfolios):
+    """Test getting all portfolios when none exist"""
+    portfolios = portfolio_service.get_all_portfolios()
+
+    assert portfolios == []
+
+
+def test_update_portfolio(portfolio_service, sample_portfolio):
+    """Test updating a portfolio"""
+    update_data = PortfolioUpdate(name="Updated Portfolio", description="Updated description")
+
+    updated_portfolio = portfolio_service.update_portfolio(sample_portfolio.id, update_data)
+
+    assert updated_portfolio is not None
+    assert updated_portfolio.name == "Updated Portfolio"
+    assert updated_portfolio.description == "Updated description"
+    assert updated_portfolio.updated_at > sample_portfolio.updated_at
+
+
+def test_update_portfolio_partial(portfolio_service, sample_portfolio):
+    """Test partial portfolio update"""
+    update_data = PortfolioUpdate(name="New Name Only")
+
+    updated_portfolio = portfolio_service.update_portfolio(sample_portfolio.id, update_data)
+
+    assert updated_portfolio is not None
+    assert updated_portfolio.name == "New Name Only"
+    assert updated_portfolio.description == sample_portfolio.description
+
+
+def test_update_portfolio_not_exists(portfolio_service, new_db):
+    """Test updating non-existent portfolio"""
+    update_data = PortfolioUpdate(name="Non-existent")
+
+    result = portfolio_service.update_portfolio(999, update_data)
+
+    assert result is None
+
+
+def test_delete_portfolio(portfolio_service, sample_portfolio):
+    """Test deleting a portfolio"""
+    result = portfolio_service.delete_portfolio(sample_portfolio.id)
+
+    assert result is True
+
+    # Verify portfolio is deleted
+    portfolio = portfolio_service.get_portfolio(sample_portfolio.id)
+    assert portfolio is None
+
+
+def test_delete_portfolio_with_holdings(portfolio_service, sample_holding):
+    """Test deleting a portfolio removes its holdings"""
+    result = portfolio_service.delete_portfolio(sample_holding.portfolio_id)
+
+    assert result is True
+    assert portfolio_service.get_holding(sample_holding.id) is None
+    assert portfolio_service.get_portfolio(sample_holding.portfolio_id) is None
+
+
+def test_delete_portfolio_not_exists(portfolio_service, new_db):
+    """Test deleting non-existent portfolio"""
+    result = portfolio_service.delete_portfolio(999)
+
+    assert result is False
+
+
+@pytest.mark.parametrize(
+    "symbol, expected_symbol, asset_type, quantity, purchase_price",
+    [
+        pytest.param("GOOGL", "GOOGL", AssetType.STOCK, "5.0", "2800.0", id="stock"),
+        pytest.param("aapl", "AAPL", AssetType.STOCK, "1.0", "150.0", id="symbol_uppercase"),
+        pytest.param("BTC-USD", "BTC-USD", AssetType.CRYPTOCURRENCY, "0.5", "45000.0", id="crypto"),
+    ],
+)
+def test_add_holding(
+    portfolio_service, sample_portfolio, symbol, expected_symbol, asset_type, quantity, purchase_price
+):
+    """Test adding a holding to portfolio, with the symbol converted to uppercase"""
     holding_data = HoldingCreate(
         portfolio_id=sample_portfolio.id,
-        symbol="AAPL",
-        asset_type=AssetType.STOCK,
-        quantity=Decimal("10.0"),
-        purchase_price=Decimal("150.0"),
-        notes="Test holding",
+        symbol=symbol,
+        asset_type=asset_type,
+        quantity=Decimal(quantity),
+        purchase_price=Decimal(purchase_price),
+        notes=f"{expected_symbol} holding",
     )
-    return portfolio_service.add_holding(holding_data)
 
+    holding = portfolio_service.add_holding(holding_data)
+
+    assert holding.id is not None
+    assert holding.portfolio_id == sample_portfolio.id
+    assert holding.symbol == expected_symbol
+    assert holding.asset_type == asset_type
+    assert holding.quantity == Decimal(quantity)
+    assert holding.purchase_price == Decimal(purchase_price)
+    assert holding.notes == f"{expected_symbol} holding"
 
-class TestPortfolioService:
-    def test_create_portfolio(self, portfolio_service, new_db):
-        """Test creating a new portfolio"""
-        portfolio_data = PortfolioCreate(name="My Portfolio", description="Investment portfolio")
 
-        portfolio = portfolio_service.create_portfolio(portfolio_data)
+def test_add_holdings(portfolio_service, sample_portfolio):
+    """Test adding several holdings at once returns them loaded and in order"""
+    holdings = portfolio_service.add_holdings(
+        [make_holding(sample_portfolio.id, "msft", QTY_1, PRICE_100), make_holding(sample_portfolio.id, "GOOGL")]
+    )
 
-        assert portfolio.id is not None
-        assert portfolio.name == "My Portfolio"
-        assert portfolio.description == "Investment portfolio"
-        assert portfolio.created_at is not None
-        assert portfolio.updated_at is not None
+    assert [h.symbol for h in holdings] == ["MSFT", "GOOGL"]
+    assert all(h.id is not None and h.created_at is not None for h in holdings)
+    assert holdings[0].quantity == QTY_1
+    assert portfolio_service.count_portfolio_holdings(sample_portfolio.id) == 2
 
-    def test_create_portfolio_minimal(self, portfolio_service, new_db):
-        """Test creating portfolio with minimal data"""
-        portfolio_data = PortfolioCreate(name="Simple Portfolio")
 
-        portfolio = portfolio_service.create_portfolio(portfolio_data)
+def test_holding_amounts_quantized():
+    """Test holding amounts are converted and quantized to 8 decimal places"""
+    # Form values arrive as floats and strings, so validate a raw dict rather than typed arguments
+    holding_data = HoldingCreate.model_validate(
+        {"portfolio_id": 1, "symbol": "ETH-USD", "quantity": 0.1, "purchase_price": "1.123456789"}
+    )
 
-        assert portfolio.id is not None
-        assert portfolio.name == "Simple Portfolio"
-        assert portfolio.description == ""
+    assert holding_data.quantity == Decimal("0.1")
+    assert holding_data.purchase_price == Decimal("1.12345679")
+    assert HoldingUpdate(notes="only notes").quantity is None
 
-    def test_get_portfolio_exists(self, portfolio_service, sample_portfolio):
-        """Test getting an existing portfolio"""
-        portfolio = portfolio_service.get_portfolio(sample_portfolio.id)
 
-        assert portfolio is not None
-        assert portfolio.id == sample_portfolio.id
-        assert portfolio.name == sample_portfolio.name
+@pytest.mark.parametrize("quantity", [0, Decimal("-1"), "abc", float("nan"), Decimal("0.000000001")])
+def test_holding_amounts_invalid(quantity):
+    """Test non-positive, non-finite and unparseable amounts are rejected"""
+    with pytest.raises(ValidationError):
+        HoldingCreate(portfolio_id=1, symbol="AAPL", quantity=quantity, purchase_price=Decimal("1"))
 
-    def test_get_portfolio_not_exists(self, portfolio_service, new_db):
-        """Test getting non-existent portfolio"""
-        portfolio = portfolio_service.get_portfolio(999)
 
-        assert portfolio is None
+def test_get_holding_exists(portfolio_service, sample_holding):
+    """Test getting an existing holding"""
+    holding = portfolio_service.get_holding(sample_holding.id)
 
-    def test_get_all_portfolios(self, portfolio_service, new_db):
-        """Test getting all portfolios"""
-        # Create multiple portfolios
-        portfolio_service.create_portfolio(PortfolioCreate(name="Portfolio 1"))
-        portfolio_service.create_portfolio(PortfolioCreate(name="Portfolio 2"))
+    assert holding is not None
+    assert holding.id == sample_holding.id
+    assert holding.symbol == sample_holding.symbol
 
-        portfolios = portfolio_service.get_all_portfolios()
 
-        assert len(portfolios) == 2
-        portfolio_names = [p.name for p in portfolios]
-        assert "Portfolio 1" in portfolio_names
-        assert "Portfolio 2" in portfolio_names
+def test_get_holding_not_exists(portfolio_service, new_db):
+    """Test getting non-existent holding"""
+    holding = portfolio_service.get_holding(999)
 
-    def test_get_all_portfolios_empty(self, portfolio_service, new_db):
-        """Test getting all portfolios when none exist"""
-        portfolios = portfolio_service.get_all_portfolios()
+    assert holding is None
 
-        assert portfolios == []
 
-    def test_update_portfolio(self, portfolio_service, sample_portfolio):
-        """Test updating a portfolio"""
-        update_data = PortfolioUpdate(name="Updated Portfolio", description="Updated description")
+def test_get_popular_symbols(portfolio_service, no_portfolios, bulk_holdings_factory):
+    """Test symbols are ranked by how many holdings reference them"""
+    portfolio = portfolio_service.create_portfolio(PortfolioCreate(name="Test Portfolio"))
+    other_portfolio = portfolio_service.create_portfolio(PortfolioCreate(name="Other Portfolio"))
+    bulk_holdings_factory(
+        make_holding(portfolio_id, symbol, QTY_1, PRICE_100)
+        for portfolio_id, symbol in [
+            (portfolio.id, "AAPL"),
+            (portfolio.id, "MSFT"),
+            (other_portfolio.id, "MSFT"),
+            (other_portfolio.id, "GOOGL"),
+        ]
+    )
 
-        updated_portfolio = portfolio_service.update_portfolio(sample_portfolio.id, update_data)
+    assert portfolio_service.get_popular_symbols() == ["MSFT", "AAPL", "GOOGL"]
+    assert portfolio_service.get_popular_symbols(limit=1) == ["MSFT"]
 
-        assert updated_portfolio is not None
-        assert updated_portfolio.name == "Updated Portfolio"
-        assert updated_portfolio.description == "Updated description"
-        assert updated_portfolio.updated_at > sample_portfolio.updated_at
 
-    def test_update_portfolio_partial(self, portfolio_service, sample_portfolio):
-        """Test partial portfolio update"""
-        update_data = PortfolioUpdate(name="New Name Only")
+def test_get_portfolio_holdings(portfolio_service, sample_portfolio, bulk_holdings_factory):
+    """Test getting all holdings for a portfolio"""
+    # Add multiple holdings
+    bulk_holdings_factory(
+        [make_holding(sample_portfolio.id), make_holding(sample_portfolio.id, "GOOGL", QTY_5, PRICE_2800)]
+    )
 
-        updated_portfolio = portfolio_service.update_portfolio(sample_portfolio.id, update_data)
+    holdings = portfolio_service.get_portfolio_holdings(sample_portfolio.id)
 
-        assert updated_portfolio is not None
-        assert updated_portfolio.name == "New Name Only"
-        assert updated_portfolio.description == sample_portfolio.description
+    assert len(holdings) == 2
+    symbols = [h.symbol for h in holdings]
+    assert "AAPL" in symbols
+    assert "GOOGL" in symbols
 
-    def test_update_portfolio_not_exists(self, portfolio_service, new_db):
-        """Test updating non-existent portfolio"""
-        update_data = PortfolioUpdate(name="Non-existent")
-
-        result = portfolio_service.update_portfolio(999, update_data)
-
-        assert result is None
-
-    def test_delete_portfolio(self, portfolio_service, sample_portfolio):
-        """Test deleting a portfolio"""
-        result = portfolio_service.delete_portfolio(sample_portfolio.id)
 
-        assert result is True
-
-        # Verify portfolio is deleted
-        portfolio = portfolio_service.get_portfolio(sample_portfolio.id)
-        assert portfolio is None
-
-    def test_delete_portfolio_not_exists(self, portfolio_service, new_db):
-        """Test deleting non-existent portfolio"""
-        result = portfolio_service.delete_portfolio(999)
-
-        assert result is False
-
-    def test_add_holding(self, portfolio_service, sample_portfolio):
-        """Test adding a holding to portfolio"""
-        holding_data = HoldingCreate(
-            portfolio_id=sample_portfolio.id,
-            symbol="GOOGL",
-            asset_type=AssetType.STOCK,
-            quantity=Decimal("5.0"),
-            purchase_price=Decimal("2800.0"),
-            notes="Google stock",
-        )
-
-        holding = portfolio_service.add_holding(holding_data)
-
-        assert holding.id is not None
-        assert holding.portfolio_id == sample_portfolio.id
-        assert holding.symbol == "GOOGL"
-        assert holding.asset_type == AssetType.STOCK
-        assert holding.quantity == Decimal("5.0")
-        assert holding.purchase_price == Decimal("2800.0")
-        assert holding.notes == "Google stock"
-
-    def test_add_holding_symbol_uppercase(self, portfolio_service, sample_portfolio):
-        """Test that symbol is converted to uppercase"""
-        holding_data = HoldingCreate(
-            portfolio_id=sample_portfolio.id,
-            symbol="aapl",
-            asset_type=AssetType.STOCK,
-            quantity=Decimal("1.0"),
-            purchase_price=Decimal("150.0"),
-        )
-
-        holding = portfolio_service.add_holding(holding_data)
+def test_get_portfolio_holdings_paginated(portfolio_service, sample_portfolio, bulk_holdings_factory):
+    """Test fetching one sorted page of holdings and counting the total"""
+    bulk_holdings_factory(
+        make_holding(sample_portfolio.id, symbol, Decimal(quantity), PRICE_100)
+        for symbol, quantity in [("AAPL", "3.0"), ("GOOGL", "1.0"), ("MSFT", "2.0")]
+    )
 
-        assert holding.symbol == "AAPL"
+    first_page = portfolio_service.get_portfolio_holdings(sample_portfolio.id, offset=0, limit=2)
+    second_page = portfolio_service.get_portfolio_holdings(sample_portfolio.id, offset=2, limit=2)
+    by_quantity = portfolio_service.get_portfolio_holdings(sample_portfolio.id, sort_by="quantity", descending=True)
 
-    def test_add_holding_crypto(self, portfolio_service, sample_portfolio):
-        """Test adding cryptocurrency holding"""
-        holding_data = HoldingCreate(
-            portfolio_id=sample_portfolio.id,
-            symbol="BTC-USD",
-            asset_type=AssetType.CRYPTOCURRENCY,
-            quantity=Decimal("0.5"),
-            purchase_price=Decimal("45000.0"),
-        )
-
-        holding = portfolio_service.add_holding(holding_data)
-
-        assert holding.symbol == "BTC-USD"
-        assert holding.asset_type == AssetType.CRYPTOCURRENCY
-        assert holding.quantity == Decimal("0.5")
-
-    def test_get_holding_exists(self, portfolio_service, sample_holding):
-        """Test getting an existing holding"""
-        holding = portfolio_service.get_holding(sample_holding.id)
-
-        assert holding is not None
-        assert holding.id == sample_holding.id
-        assert holding.symbol == sample_holding.symbol
-
-    def test_get_holding_not_exists(self, portfolio_service, new_db):
-        """Test getting non-existent holding"""
-        holding = portfolio_service.get_holding(999)
-
-        assert holding is None
-
-    def test_get_portfolio_holdings(self, portfolio_service, sample_portfolio):
-        """Test getting all holdings for a portfolio"""
-        # Add multiple holdings
-        holding1_data = HoldingCreate(
-            portfolio_id=sample_portfolio.id,
-            symbol="AAPL",
-            asset_type=AssetType.STOCK,
-            quantity=Decimal("10.0"),
-            purchase_price=Decimal("150.0"),
-        )
-        holding2_data = HoldingCreate(
-            portfolio_id=sample_portfolio.id,
-            symbol="GOOGL",
-            asset_type=AssetType.STOCK,
-            quantity=Decimal("5.0"),
-            purchase_price=Decimal("2800.0"),
-        )
-
-        portfolio_service.add_holding(holding1_data)
-        portfolio_service.add_holding(holding2_data)
-
-        holdings = portfolio_service.get_portfolio_holdings(sample_portfolio.id)
-
-        assert len(holdings) == 2
-        symbols = [h.symbol for h in holdings]
-        assert "AAPL" in symbols
-        assert "GOOGL" in symbols
-
-    def test_get_portfolio_holdings_empty(self, portfolio_service, sample_portfolio):
-        """Test getting holdings for portfolio with no holdings"""
-        holdings = portfolio_service.get_portfolio_holdings(sample_portfolio.id)
-
-        assert holdings == []
-
-    def test_update_holding(self, portfolio_service, sample_holding):
-        """Test updating a holding"""
-        update_data = HoldingUpdate(quantity=Decimal("15.0"), purchase_price=Decimal("160.0"), notes="Updated holding")
-
-        updated_holding = portfolio_service.update_holding(sample_holding.id, update_data)
-
-        assert updated_holding is not None
-        assert updated_holding.quantity == Decimal("15.0")
-        assert updated_holding.purchase_price == Decimal("160.0")
-        assert updated_holding.notes == "Updated holding"
-        assert updated_holding.updated_at > sample_holding.updated_at
-
-    def test_update_holding_not_exists(self, portfolio_service, new_db):
-        """Test updating non-existent holding"""
-        update_data = HoldingUpdate(quantity=Decimal("1.0"))
-
-        result = portfolio_service.update_holding(999, update_data)
-
-        assert result is None
-
-    def test_delete_holding(self, portfolio_service, sample_holding):
-        """Test deleting a holding"""
-        result = portfolio_service.delete_holding(sample_holding.id)
-
-        assert result is True
-
-        # Verify holding is deleted
-        holding = portfolio_service.get_holding(sample_holding.id)
-        assert holding is None
-
-    def test_delete_holding_not_exists(self, portfolio_service, new_db):
-        """Test deleting non-existent holding"""
-        result = portfolio_service.delete_holding(999)
-
-        assert result is False
-
-    @patch("app.portfolio_service.price_service.get_multiple_prices")
-    async def test_get_holdings_with_metrics(self, mock_get_prices, portfolio_service, sample_portfolio):
-        """Test getting holdings with calculated metrics"""
-        # Add holdings
-        holding1_data = HoldingCreate(
-            portfolio_id=sample_portfolio.id,
-            symbol="AAPL",
-            asset_type=AssetType.STOCK,
-            quantity=Decimal("10.0"),
-            purchase_price=Decimal("150.0"),
-        )
-        holding2_data = HoldingCreate(
-            portfolio_id=sample_portfolio.id,
-            symbol="GOOGL",
-            asset_type=AssetType.STOCK,
-            quantity=Decimal("5.0"),
-            purchase_price=Decimal("2800.0"),
-        )
-
-        portfolio_service.add_holding(holding1_data)
-        portfolio_service.add_holding(holding2_data)
-
-        # Mock price service
-        mock_get_prices.return_value = {"AAPL": Decimal("160.0"), "GOOGL": Decimal("2900.0")}
-
-        holdings = await portfolio_service.get_holdings_with_metrics(sample_portfolio.id)
-
-        assert len(holdings) == 2
-
-        # Check AAPL metrics
-        aapl_holding = next(h for h in holdings if h.symbol == "AAPL")
-        assert aapl_holding.current_price == Decimal("160.0")
-        assert aapl_holding.total_cost == Decimal("1500.0")  # 10 * 150
-        assert aapl_holding.current_value == Decimal("1600.0")  # 10 * 160
-        assert aapl_holding.absolute_return == Decimal("100.0")  # 1600 - 1500
-        assert abs(aapl_holding.percentage_return - Decimal("6.67")) < Decimal("0.01")  # 100/1500 * 100
-
-        # Check GOOGL metrics
-        googl_holding = next(h for h in holdings if h.symbol == "GOOGL")
-        assert googl_holding.current_price == Decimal("2900.0")
-        assert googl_holding.total_cost == Decimal("14000.0")  # 5 * 2800
-        assert googl_holding.current_value == Decimal("14500.0")  # 5 * 2900
-        assert googl_holding.absolute_return == Decimal("500.0")  # 14500 - 14000
-
-    async def test_get_holdings_with_metrics_empty_portfolio(self, portfolio_service, sample_portfolio):
-        """Test getting metrics for empty portfolio"""
-        holdings = await portfolio_service.get_holdings_with_metrics(sample_portfolio.id)
-
-        assert holdings == []
-
-    @patch("app.portfolio_service.price_service.get_multiple_prices")
-    async def test_get_holdings_with_metrics_no_prices(self, mock_get_prices, portfolio_service, sample_portfolio):
-        """Test getting holdings when prices are unavailable"""
-        # Add holding
-        holding_data = HoldingCreate(
-            portfolio_id=sample_portfolio.id,
-            symbol="AAPL",
-            asset_type=AssetType.STOCK,
-            quantity=Decimal("10.0"),
-            purchase_price=Decimal("150.0"),
-        )
-        portfolio_service.add_holding(holding_data)
-
-        # Mock price service to return None
-        mock_get_prices.return_value = {"AAPL": None}
-
-        holdings = await portfolio_service.get_holdings_with_metrics(sample_portfolio.id)
-
-        assert len(holdings) == 1
-        holding = holdings[0]
-        assert holding.current_price is None
-        assert holding.current_value is None
-        assert holding.absolute_return is None
-        assert holding.percentage_return is None
-        assert holding.total_cost == Decimal("1500.0")
-
-    @patch("app.portfolio_service.price_service.get_multiple_prices")
-    async def test_get_portfolio_summary(self, mock_get_prices, portfolio_service, sample_portfolio):
-        """Test getting portfolio summary"""
-        # Add holdings
-        holding1_data = HoldingCreate(
-            portfolio_id=sample_portfolio.id,
-            symbol="AAPL",
-            asset_type=AssetType.STOCK,
-            quantity=Decimal("10.0"),
-            purchase_price=Decimal("150.0"),
-        )
-        holding2_data = HoldingCreate(
-            portfolio_id=sample_portfolio.id,
-            symbol="GOOGL",
-            asset_type=AssetType.STOCK,
-            quantity=Decimal("5.0"),
-            purchase_price=Decimal("2800.0"),
-        )
-
-        portfolio_service.add_holding(holding1_data)
-        portfolio_service.add_holding(holding2_data)
-
-        # Mock price service
-        mock_get_prices.return_value = {
-            "AAPL": Decimal("160.0"),  # +6.67% return
-            "GOOGL": Decimal("2700.0"),  # -3.57% return
-        }
+    assert [h.symbol for h in first_page] == ["AAPL", "GOOGL"]
+    assert [h.symbol for h in second_page] == ["MSFT"]
+    assert [h.symbol for h in by_quantity] == ["AAPL", "MSFT", "GOOGL"]
+    assert portfolio_service.count_portfolio_holdings(sample_portfolio.id) == 3
 
-        summary = await portfolio_service.get_portfolio_summary(sample_portfolio.id)
 
-        assert summary is not None
-        assert summary.portfolio_id == sample_portfolio.id
-        assert summary.portfolio_name == sample_portfolio.name
-        assert summary.total_holdings == 2
-        assert summary.total_cost == Decimal("15500.0")  # 1500 + 14000
-        assert summary.total_current_value == Decimal("15100.0")  # 1600 + 13500
-        assert summary.total_absolute_return == Decimal("-400.0")  # 15100 - 15500
-        assert summary.best_performer == "AAPL"
-        assert summary.worst_performer == "GOOGL"
-
-    async def test_get_portfolio_summary_empty_portfolio(self, portfolio_service, sample_portfolio):
-        """Test getting summary for empty portfolio"""
+def test_get_portfolio_holdings_empty(portfolio_service, sample_portfolio):
+    """Test getting holdings for portfolio with no holdings"""
+    holdings = portfolio_service.get_portfolio_holdings(sample_portfolio.id)
+
+    assert holdings == []
+
+
+def test_update_holding(portfolio_service, sample_holding):
+    """Test updating a holding"""
+    update_data = HoldingUpdate(quantity=Decimal("15.0"), purchase_price=PRICE_160, notes="Updated holding")
+
+    updated_holding = portfolio_service.update_holding(sample_holding.id, update_data)
+
+    assert updated_holding is not None
+    assert updated_holding.quantity == Decimal("15.0")
+    assert updated_holding.purchase_price == PRICE_160
+    assert updated_holding.notes == "Updated holding"
+    assert updated_holding.updated_at > sample_holding.updated_at
+
+
+def test_update_holding_not_exists(portfolio_service, new_db):
+    """Test updating non-existent holding"""
+    update_data = HoldingUpdate(quantity=QTY_1)
+
+    result = portfolio_service.update_holding(999, update_data)
+
+    assert result is None
+
+
+def test_delete_holding(portfolio_service, sample_holding):
+    """Test deleting a holding"""
+    result = portfolio_service.delete_holding(sample_holding.id)
+
+    assert result is True
+
+    # Verify holding is deleted
+    holding = portfolio_service.get_holding(sample_holding.id)
+    assert holding is None
+
+
+def test_delete_holding_not_exists(portfolio_service, new_db):
+    """Test deleting non-existent holding"""
+    result = portfolio_service.delete_holding(999)
+
+    assert result is False
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("holdings_with_prices", [DEFAULT_HOLDINGS], indirect=True, ids=["default"])
+@patch("app.portfolio_service.price_service.get_multiple_prices")
+async def test_get_holdings_with_metrics(mock_get_prices, portfolio_service, new_db, holdings_with_prices):
+    """Test getting holdings with calculated metrics"""
+    # Mock price service
+    mock_get_prices.return_value = {"AAPL": PRICE_160, "GOOGL": PRICE_2900}
+
+    holdings = await portfolio_service.get_holdings_with_metrics(holdings_with_prices.id)
+
+    assert len(holdings) == 2
+    by_symbol = {h.symbol: h for h in holdings}
+
+    # Check AAPL metrics
+    aapl_holding = by_symbol["AAPL"]
+    assert aapl_holding.current_price == PRICE_160
+    assert aapl_holding.total_cost == Decimal("1500.0")  # 10 * 150
+    assert aapl_holding.current_value == Decimal("1600.0")  # 10 * 160
+    assert aapl_holding.absolute_return == PRICE_100  # 1600 - 1500
+    assert aapl_holding.percentage_return == pytest.approx(6.67, abs=0.01)  # 100/1500 * 100
+
+    # Check GOOGL metrics
+    googl_holding = by_symbol["GOOGL"]
+    assert googl_holding.current_price == PRICE_2900
+    assert googl_holding.total_cost == Decimal("14000.0")  # 5 * 2800
+    assert googl_holding.current_value == Decimal("14500.0")  # 5 * 2900
+    assert googl_holding.absolute_return == Decimal("500.0")  # 14500 - 14000
+
+
+@pytest.mark.slow
+@patch("app.portfolio_service.price_service.get_multiple_prices")
+async def test_get_holdings_batch(mock_get_prices, portfolio_service, sample_portfolio, bulk_holdings_factory):
+    """Test columnar holdings metrics, with missing prices mapped to None"""
+    bulk_holdings_factory(make_holding(sample_portfolio.id, symbol) for symbol in ["AAPL", "GOOGL"])
+    mock_get_prices.return_value = {"AAPL": PRICE_160, "GOOGL": None}
+
+    batch = await portfolio_service.get_holdings_batch(sample_portfolio.id)
+
+    assert len(batch) == 2
+    assert [h.symbol for h in batch.holdings] == ["AAPL", "GOOGL"]
+    assert batch.total_cost.tolist() == [1500.0, 1500.0]
+    assert batch.values("current_value") == [1600.0, None]
+    assert batch.values("absolute_return") == [100.0, None]
+
+
+@pytest.mark.slow
+async def test_get_holdings_with_metrics_price_provider(sample_holding):
+    """Test an injected price provider replaces price_service lookups"""
+    price_provider = AsyncMock(return_value={"AAPL": PRICE_160})
+    service = PortfolioService(price_provider=price_provider)
+
+    holdings = await service.get_holdings_with_metrics(sample_holding.portfolio_id)
+
+    price_provider.assert_awaited_once_with(["AAPL"])
+    assert holdings[0].current_value == Decimal("1600.0")
+
+
+@pytest.mark.slow
+async def test_get_holdings_with_metrics_empty_portfolio(portfolio_service, sample_portfolio):
+    """Test getting metrics for empty portfolio"""
+    holdings = await portfolio_service.get_holdings_with_metrics(sample_portfolio.id)
+
+    assert holdings == []
+
+
+@pytest.mark.slow
+@patch("app.portfolio_service.price_service.get_multiple_prices")
+async def test_get_holdings_with_metrics_no_prices(mock_get_prices, portfolio_service, sample_portfolio):
+    """Test getting holdings when prices are unavailable"""
+    # Add holding
+    holding_data = make_holding(sample_portfolio.id)
+    portfolio_service.add_holding(holding_data)
+
+    # Mock price service to return None
+    mock_get_prices.return_value = {"AAPL": None}
+
+    holdings = await portfolio_service.get_holdings_with_metrics(sample_portfolio.id)
+
+    assert len(holdings) == 1
+    holding = holdings[0]
+    assert holding.current_price is None
+    assert holding.current_value is None
+    assert holding.absolute_return is None
+    assert holding.percentage_return is None
+    assert holding.total_cost == Decimal("1500.0")
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("holdings_with_prices", [DEFAULT_HOLDINGS], indirect=True, ids=["default"])
+@patch("app.portfolio_service.price_service.get_multiple_prices")
+async def test_get_portfolio_summary(mock_get_prices, portfolio_service, new_db, holdings_with_prices):
+    """Test getting portfolio summary"""
+    # Mock price service
+    mock_get_prices.return_value = {
+        "AAPL": PRICE_160,  # +6.67% return
+        "GOOGL": PRICE_2700,  # -3.57% return
+    }
+
+    summary = await portfolio_service.get_portfolio_summary(holdings_with_prices.id)
+
+    assert summary is not None
+    assert summary.portfolio_id == holdings_with_prices.id
+    assert summary.portfolio_name == holdings_with_prices.name
+    assert summary.total_holdings == 2
+    assert summary.total_cost == Decimal("15500.0")  # 1500 + 14000
+    assert summary.total_current_value == Decimal("15100.0")  # 1600 + 13500
+    assert summary.total_absolute_return == Decimal("-400.0")  # 15100 - 15500
+    assert summary.best_performer == "AAPL"
+    assert summary.worst_performer == "GOOGL"
+
+
+@pytest.mark.slow
+@patch("app.portfolio_service.price_service.get_multiple_prices")
+async def test_get_portfolio_summary_query_count(
+    mock_get_prices, portfolio_service, sample_portfolio, bulk_holdings_factory
+):
+    """Test summary loads portfolio and holdings with a constant number of queries"""
+    bulk_holdings_factory(
+        make_holding(sample_portfolio.id, symbol, QTY_1, PRICE_100) for symbol in ("AAPL", "GOOGL", "MSFT")
+    )
+    mock_get_prices.return_value = {"AAPL": Decimal("110.0"), "GOOGL": Decimal("90.0"), "MSFT": None}
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(ENGINE, "before_cursor_execute", count_statement)
+    try:
         summary = await portfolio_service.get_portfolio_summary(sample_portfolio.id)
+    finally:
+        event.remove(ENGINE, "before_cursor_execute", count_statement)
+
+    assert summary is not None
+    assert summary.total_holdings == 3
+    holding_queries = [statement for statement in statements if "FROM holdings" in statement]
+    assert len(holding_queries) == 1  # selectin-loaded with the portfolio, not per holding
+
+
+@pytest.mark.slow
+@patch("app.portfolio_service.price_service.get_multiple_prices")
+async def test_get_portfolio_summary_cached_until_holdings_change(mock_get_prices, portfolio_service, sample_holding):
+    """Test summary is served from cache and recomputed after a holding write"""
+    mock_get_prices.return_value = {"AAPL": PRICE_160}
+
+    first = await portfolio_service.get_portfolio_summary(sample_holding.portfolio_id)
+    second = await portfolio_service.get_portfolio_summary(sample_holding.portfolio_id)
+
+    assert first is not None and second is not None
+    assert second.total_cost == first.total_cost == 1500.0
+    assert mock_get_prices.call_count == 1
+
+    portfolio_service.update_holding(sample_holding.id, HoldingUpdate(quantity=Decimal("20.0")))
+    third = await portfolio_service.get_portfolio_summary(sample_holding.portfolio_id)
+
+    assert third is not None
+    assert third.total_cost == 3000.0
+    assert mock_get_prices.call_count == 2
+
+
+@pytest.mark.slow
+@patch("app.portfolio_service.price_service.get_multiple_prices")
+async def test_get_portfolio_summary_keeps_dirty_mark_from_concurrent_write(
+    mock_get_prices, portfolio_service, sample_holding
+):
+    """Test a holding write made while a summary is computed is not hidden by storing that summary"""
+
+    async def prices_with_concurrent_write(symbols):
+        portfolio_service.update_holding(sample_holding.id, HoldingUpdate(quantity=Decimal("20.0")))
+        return {"AAPL": PRICE_160}
+
+    mock_get_prices.side_effect = prices_with_concurrent_write
+    first = await portfolio_service.get_portfolio_summary(sample_holding.portfolio_id)
+
+    mock_get_prices.side_effect = None
+    mock_get_prices.return_value = {"AAPL": PRICE_160}
+    second = await portfolio_service.get_portfolio_summary(sample_holding.portfolio_id)
+
+    assert first is not None and second is not None
+    assert first.total_cost == 1500.0
+    assert second.total_cost == 3000.0
+    assert mock_get_prices.call_count == 2
+
+
+@pytest.mark.slow
+async def test_get_portfolio_summary_survives_its_own_price_fetch(portfolio_service, sample_holding, monkeypatch):
+    """Test prices downloaded for a summary are stored without invalidating that summary"""
+    download = MagicMock(return_value=pd.concat({"AAPL": pd.DataFrame({"Close": [160.0]})}, axis=1))
+    monkeypatch.setattr("app.price_service.yf.download", download)
+    monkeypatch.setattr(price_service, "_price_cache", PriceCache(maxsize=10))
+
+    summary = await portfolio_service.get_portfolio_summary(sample_holding.portfolio_id)
+    cached, _, _ = portfolio_service._load_summary_inputs(sample_holding.portfolio_id)
+
+    download.assert_called_once()
+    assert summary is not None and cached is not None
+    assert cached.total_current_value == summary.total_current_value == 1600.0
+
+
+@pytest.mark.slow
+@patch("app.portfolio_service.price_service.get_multiple_prices")
+async def test_get_portfolio_summary_recomputed_after_price_ingestion(
+    mock_get_prices, portfolio_service, sample_holding
+):
+    """Test storing a new price marks summaries of portfolios holding the symbol dirty"""
+    mock_get_prices.return_value = {"AAPL": PRICE_160}
+    await portfolio_service.get_portfolio_summary(sample_holding.portfolio_id)
+
+    await price_service._store_price_history({"AAPL": Decimal("170.0")})
+    summary = await portfolio_service.get_portfolio_summary(sample_holding.portfolio_id)
+
+    # Recomputed from the freshly stored price, so no second live fetch is needed
+    assert summary is not None
+    assert summary.total_current_value == 1700.0
+    assert mock_get_prices.call_count == 1
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("holdings_with_prices", [DEFAULT_HOLDINGS], indirect=True, ids=["default"])
+@patch("app.portfolio_service.price_service.get_multiple_prices")
+async def test_get_portfolio_summary_fetches_only_stale_prices(
+    mock_get_prices, portfolio_service, new_db, holdings_with_prices
+):
+    """Test summary uses fresh stored prices and only fetches symbols with a missing or stale one"""
+    await price_service._store_price_history({"AAPL": PRICE_160})
+    await price_service._store_price_history({"GOOGL": PRICE_2900}, utc_now() - timedelta(minutes=10))
+    mock_get_prices.return_value = {"GOOGL": PRICE_2700}
+
+    summary = await portfolio_service.get_portfolio_summary(holdings_with_prices.id)
+
+    mock_get_prices.assert_called_once_with(["GOOGL"])
+    assert summary is not None
+    assert summary.total_cost == pytest.approx(15500.0)  # 1500 + 14000
+    assert summary.total_current_value == pytest.approx(15100.0)  # 1600 + 13500
+    assert summary.best_performer == "AAPL"
+    assert summary.worst_performer == "GOOGL"
+
+
+@pytest.mark.slow
+@patch("app.portfolio_service.price_service.get_multiple_prices")
+async def test_get_portfolio_summary_performers_skip_missing_prices(
+    mock_get_prices, portfolio_service, sample_portfolio, bulk_holdings_factory
+):
+    """Test best and worst performers ignore holdings without a current price"""
+    bulk_holdings_factory(
+        make_holding(sample_portfolio.id, symbol, QTY_1, PRICE_100) for symbol in ["AAPL", "GOOGL", "MSFT"]
+    )
+    mock_get_prices.return_value = {"AAPL": None, "GOOGL": Decimal("90.0"), "MSFT": Decimal("120.0")}
+
+    summary = await portfolio_service.get_portfolio_summary(sample_portfolio.id)
+
+    assert summary is not None
+    assert summary.best_performer == "MSFT"
+    assert summary.worst_performer == "GOOGL"
+    assert summary.total_cost == 300.0
+    assert summary.total_current_value == 210.0
+
+
+@pytest.mark.slow
+async def test_get_portfolio_summary_empty_portfolio(portfolio_service, sample_portfolio):
+    """Test getting summary for empty portfolio"""
+    summary = await portfolio_service.get_portfolio_summary(sample_portfolio.id)
+
+    assert summary is not None
+    assert summary.portfolio_id == sample_portfolio.id
+    assert summary.total_holdings == 0
+    assert summary.total_cost == Decimal("0")
+    assert summary.total_current_value == Decimal("0")
+    assert summary.total_absolute_return == Decimal("0")
+    assert summary.total_percentage_return == Decimal("0")
+    assert summary.best_performer is None
+    assert summary.worst_performer is None
+
+
+@pytest.mark.slow
+async def test_get_portfolio_summary_not_exists(portfolio_service, new_db):
+    """Test getting summary for non-existent portfolio"""
+    summary = await portfolio_service.get_portfolio_summary(999)
 
-        assert summary is not None
-        assert summary.portfolio_id == sample_portfolio.id
-        assert summary.total_holdings == 0
-        assert summary.total_cost == Decimal("0")
-        assert summary.total_current_value == Decimal("0")
-        assert summary.total_absolute_return == Decimal("0")
-        assert summary.total_percentage_return == Decimal("0")
-        assert summary.best_performer is None
-        assert summary.worst_performer is None
-
-    async def test_get_portfolio_summary_not_exists(self, portfolio_service, new_db):
-        """Test getting summary for non-existent portfolio"""
-        summary = await portfolio_service.get_portfolio_summary(999)
-
-        assert summary is None
+    assert summary is None
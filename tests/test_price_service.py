@@ -1,8 +1,49 @@
+import asyncio
+import time
+import pandas as pd
 import pytest
+from dataclasses import dataclass, field
+from datetime import timedelta
 from decimal import Decimal
+from types import SimpleNamespace
+from typing import Any, List
 from unittest.mock import patch, MagicMock
-from app.price_service import PriceService
-from app.database import reset_db
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine
+from sqlmodel import select
+import app.database
+from app.models import PriceHistory, utc_now
+from app.price_service import _SESSION, PriceCache, PriceService
+
+# Successful fetches write price history, so every test runs inside a rolled-back transaction
+pytestmark = pytest.mark.usefixtures("new_db")
+
+
+def _download_frame(closes):
+    """Build a yf.download(group_by="ticker") result with one Close row per symbol"""
+    return pd.concat({symbol: pd.DataFrame({"Close": [close]}) for symbol, close in closes.items()}, axis=1)
+
+
+@dataclass
+class FakeTicker:
+    """Minimal yf.Ticker stand-in exposing only the attributes the price service reads"""
+
+    info: dict = field(default_factory=dict)
+    fast_info: Any = None
+    hist: Any = None
+    history_periods: List[str] = field(default_factory=list)
+
+    def history(self, period):
+        self.history_periods.append(period)
+        return self.hist
+
+
+@pytest.fixture(scope="module")
+def ticker_mocks():
+    """Configured yf.Ticker stand-ins built once per module and looked up by symbol"""
+    return {
+        symbol: FakeTicker(info={"currentPrice": price})
+        for symbol, price in {"AAPL": 150.50, "GOOGL": 2500.0, "MSFT": 300.0}.items()
+    }
 
 
 @pytest.fixture
@@ -11,138 +52,216 @@ def price_service():
 
 
 @pytest.fixture
-def new_db():
-    reset_db()
-    yield
-    reset_db()
+def seeded_cache(price_service):
+    """Seed the price cache with a fresh TEST entry and return its price"""
+    cached_price = Decimal("100.00")
+    price_service._price_cache["TEST"] = (cached_price, utc_now())
+    return cached_price
+
+
+@pytest.fixture(autouse=True)
+def mock_ticker(monkeypatch):
+    """Stub yf.Ticker for every test so none can reach the network; tests configure the returned mock"""
+    stub = MagicMock()
+    monkeypatch.setattr("app.price_service.yf.Ticker", stub)
+    return stub
+
+
+@pytest.fixture(autouse=True)
+def mock_download(monkeypatch):
+    """Stub yf.download for every test so none can reach the network; tests configure the returned mock"""
+    stub = MagicMock()
+    monkeypatch.setattr("app.price_service.yf.download", stub)
+    return stub
 
 
 class TestPriceService:
     def test_price_service_initialization(self, price_service):
         """Test price service initializes correctly"""
         assert price_service.throttler is not None
+        assert (price_service.throttler.rate_limit, price_service.throttler.period) == (10, 60)
         assert price_service._price_cache == {}
         assert price_service._cache_duration == 300
 
-    @patch("app.price_service.yf.Ticker")
-    async def test_get_current_price_success(self, mock_ticker, price_service):
-        """Test successful price retrieval"""
-        # Mock yfinance response
-        mock_ticker_instance = MagicMock()
-        mock_ticker_instance.info = {"currentPrice": 150.50}
-        mock_ticker.return_value = mock_ticker_instance
+    @pytest.mark.parametrize(
+        "symbol, expected",
+        [
+            pytest.param("AAPL", Decimal("150.50"), id="success"),
+            pytest.param("INVALID", None, id="failure"),
+        ],
+    )
+    async def test_get_current_price(self, mock_ticker, ticker_mocks, price_service, symbol, expected):
+        """Test price retrieval from yfinance info and handling of retrieval failure"""
+        # Unknown symbols raise KeyError from the lookup, standing in for a failed yfinance request
+        mock_ticker.side_effect = lambda symbol, **kwargs: ticker_mocks[symbol]
+
+        price = await price_service.get_current_price(symbol)
+
+        assert price == expected
+        mock_ticker.assert_called_once_with(symbol, session=_SESSION)
+
+    async def test_get_current_price_uses_fast_info(self, mock_ticker, price_service):
+        """Test price is read from fast_info without loading the full info"""
+        # Without fast_info there is no price to find: info is empty and there is no history to fall back to
+        mock_ticker.return_value = FakeTicker(fast_info=SimpleNamespace(last_price=151.25))
 
         price = await price_service.get_current_price("AAPL")
 
-        assert price == Decimal("150.50")
-        mock_ticker.assert_called_once_with("AAPL")
+        assert price == Decimal("151.25")
 
-    @patch("app.price_service.yf.Ticker")
     async def test_get_current_price_fallback_to_history(self, mock_ticker, price_service):
         """Test fallback to history when info doesn't have price"""
-        # Mock yfinance response without currentPrice
-        mock_ticker_instance = MagicMock()
-        mock_ticker_instance.info = {}
-
-        # Mock history data
-        import pandas as pd
-
-        mock_history = pd.DataFrame({"Close": [145.25]})
-        mock_ticker_instance.history.return_value = mock_history
-        mock_ticker.return_value = mock_ticker_instance
+        # Mock yfinance response without currentPrice, with history data to fall back to
+        fake_ticker = FakeTicker(hist=pd.DataFrame({"Close": [145.25]}))
+        mock_ticker.return_value = fake_ticker
 
         price = await price_service.get_current_price("AAPL")
 
         assert price == Decimal("145.25")
-        mock_ticker_instance.history.assert_called_once_with(period="1d")
+        assert fake_ticker.history_periods == ["1d"]
 
-    @patch("app.price_service.yf.Ticker")
-    async def test_get_current_price_failure(self, mock_ticker, price_service):
-        """Test handling of price retrieval failure"""
-        mock_ticker.side_effect = Exception("Network error")
+    async def test_price_caching(self, price_service, seeded_cache, mock_ticker):
+        """Test price caching functionality"""
+        # Should return cached price without API call
+        price = await price_service.get_current_price("TEST")
+        assert price == seeded_cache
+        mock_ticker.assert_not_called()
+
+    @pytest.mark.parametrize(
+        "closes, symbols, expected",
+        [
+            pytest.param(
+                {"AAPL": 150.0, "GOOGL": 2500.0, "MSFT": 300.0},
+                ["AAPL", "GOOGL", "MSFT", "AAPL"],
+                {"AAPL": Decimal("150.0"), "GOOGL": Decimal("2500.0"), "MSFT": Decimal("300.0")},
+                id="all_found",
+            ),
+            pytest.param(
+                {"AAPL": 100.0, "INVALID": None, "GOOGL": 100.0},
+                ["AAPL", "INVALID", "GOOGL"],
+                {"AAPL": Decimal("100.0"), "INVALID": None, "GOOGL": Decimal("100.0")},
+                id="with_failures",
+            ),
+        ],
+    )
+    async def test_get_multiple_prices(self, mock_download, price_service, closes, symbols, expected):
+        """Test getting multiple prices with one batched download, including symbols missing from it"""
+        mock_download.return_value = _download_frame(closes)
 
-        price = await price_service.get_current_price("INVALID")
+        prices = await price_service.get_multiple_prices(symbols)
 
-        assert price is None
+        assert prices == expected
+        mock_download.assert_called_once()
+        assert mock_download.call_args.args[0] == list(dict.fromkeys(symbols))
 
-    async def test_price_caching(self, price_service):
-        """Test price caching functionality"""
-        # Mock a price in cache
-        from datetime import datetime
+    async def test_get_multiple_prices_downloads_only_cache_misses(self, mock_download, price_service):
+        """Test cached symbols are not downloaded again"""
+        price_service._price_cache["AAPL"] = (Decimal("150.0"), utc_now())
+        mock_download.return_value = _download_frame({"GOOGL": 2500.0})
 
-        cached_price = Decimal("100.00")
-        price_service._price_cache["TEST"] = (cached_price, datetime.now())
+        prices = await price_service.get_multiple_prices(["AAPL", "GOOGL"])
 
-        # Should return cached price without API call
-        price = await price_service.get_current_price("TEST")
-        assert price == cached_price
+        assert prices == {"AAPL": Decimal("150.0"), "GOOGL": Decimal("2500.0")}
+        assert mock_download.call_args.args[0] == ["GOOGL"]
 
-    @patch("app.price_service.yf.Ticker")
-    async def test_get_multiple_prices(self, mock_ticker, price_service):
-        """Test getting multiple prices concurrently"""
+    async def test_get_multiple_prices_download_error(self, mock_download, price_service):
+        """Test a failed download falls back to last known prices"""
+        mock_download.side_effect = Exception("Network error")
 
-        # Mock different prices for different symbols
-        def mock_ticker_factory(symbol):
-            mock_instance = MagicMock()
-            prices = {"AAPL": 150.0, "GOOGL": 2500.0, "MSFT": 300.0}
-            mock_instance.info = {"currentPrice": prices.get(symbol, 100.0)}
-            return mock_instance
+        with patch.object(
+            price_service, "_get_last_known_prices", return_value={"AAPL": Decimal("140.0")}
+        ) as mock_last_known:
+            prices = await price_service.get_multiple_prices(["AAPL", "GOOGL"])
 
-        mock_ticker.side_effect = mock_ticker_factory
+        assert prices == {"AAPL": Decimal("140.0"), "GOOGL": None}
+        mock_last_known.assert_called_once_with(["AAPL", "GOOGL"])
 
-        symbols = ["AAPL", "GOOGL", "MSFT"]
-        prices = await price_service.get_multiple_prices(symbols)
+    @pytest.mark.parametrize("frame", [None, pd.DataFrame()], ids=["none", "empty"])
+    async def test_get_multiple_prices_no_download_data(self, mock_download, price_service, frame):
+        """Test a download without data falls back to last known prices"""
+        mock_download.return_value = frame
 
-        assert len(prices) == 3
-        assert prices["AAPL"] == Decimal("150.0")
-        assert prices["GOOGL"] == Decimal("2500.0")
-        assert prices["MSFT"] == Decimal("300.0")
+        with patch.object(price_service, "_get_last_known_prices", return_value={"AAPL": Decimal("140.0")}):
+            prices = await price_service.get_multiple_prices(["AAPL", "GOOGL"])
 
-    @patch("app.price_service.yf.Ticker")
-    async def test_get_multiple_prices_with_failures(self, mock_ticker, price_service):
-        """Test handling failures in multiple price requests"""
+        assert prices == {"AAPL": Decimal("140.0"), "GOOGL": None}
 
-        def mock_ticker_factory(symbol):
-            if symbol == "INVALID":
-                raise Exception("Invalid symbol")
-            mock_instance = MagicMock()
-            mock_instance.info = {"currentPrice": 100.0}
-            return mock_instance
+    async def test_get_multiple_prices_concurrent_callers_share_download(self, mock_download, price_service):
+        """Test concurrent requests for the same symbols trigger a single download"""
+        mock_download.return_value = _download_frame({"AAPL": 150.0, "GOOGL": 2500.0})
 
-        mock_ticker.side_effect = mock_ticker_factory
+        first, second = await asyncio.gather(
+            price_service.get_multiple_prices(["AAPL", "GOOGL"]),
+            price_service.get_multiple_prices(["GOOGL", "AAPL"]),
+        )
 
-        symbols = ["AAPL", "INVALID", "GOOGL"]
-        prices = await price_service.get_multiple_prices(symbols)
+        assert first == second == {"AAPL": Decimal("150.0"), "GOOGL": Decimal("2500.0")}
+        mock_download.assert_called_once()
 
-        assert len(prices) == 3
-        assert prices["AAPL"] == Decimal("100.0")
-        assert prices["INVALID"] is None
-        assert prices["GOOGL"] == Decimal("100.0")
+    async def test_get_multiple_prices_serializes_downloads(self, mock_download, price_service):
+        """Test batches for different symbols never run yf.download at the same time"""
+        active = []
+        overlapped = []
 
-    def test_clear_cache(self, price_service):
-        """Test cache clearing functionality"""
-        # Add some data to cache
-        from datetime import datetime
+        def download(symbols, **kwargs):
+            active.append(symbols)
+            overlapped.append(len(active) > 1)
+            time.sleep(0.05)
+            active.remove(symbols)
+            return _download_frame({symbol: 100.0 for symbol in symbols})
+
+        mock_download.side_effect = download
+
+        first, second = await asyncio.gather(
+            price_service.get_multiple_prices(["AAPL"]), price_service.get_multiple_prices(["GOOGL"])
+        )
+
+        assert first == {"AAPL": Decimal("100.0")}
+        assert second == {"GOOGL": Decimal("100.0")}
+        assert overlapped == [False, False]
+
+    async def test_get_current_price_concurrent_callers_share_fetch(self, mock_ticker, ticker_mocks, price_service):
+        """Test concurrent requests for one symbol trigger a single yfinance lookup"""
+        mock_ticker.return_value = ticker_mocks["AAPL"]
+
+        first, second = await asyncio.gather(
+            price_service.get_current_price("AAPL"), price_service.get_current_price("AAPL")
+        )
+
+        assert first == second == Decimal("150.50")
+        mock_ticker.assert_called_once()
+        assert price_service._pending == {}
 
-        price_service._price_cache["TEST"] = (Decimal("100.00"), datetime.now())
+    def test_price_cache_evicts_least_recently_used(self, price_service):
+        """Test the price cache stays bounded and keeps recently read symbols"""
+        price_service._price_cache = PriceCache(maxsize=2)
+        now = utc_now()
+        price_service._price_cache["AAPL"] = (Decimal("150.0"), now)
+        price_service._price_cache["GOOGL"] = (Decimal("2500.0"), now)
 
+        assert price_service._get_cached_price("AAPL") == Decimal("150.0")
+        price_service._price_cache["MSFT"] = (Decimal("300.0"), now)
+
+        assert list(price_service._price_cache) == ["AAPL", "MSFT"]
+
+    def test_clear_cache(self, price_service, seeded_cache):
+        """Test cache clearing functionality"""
         assert len(price_service._price_cache) == 1
 
         price_service.clear_cache()
 
         assert len(price_service._price_cache) == 0
 
-    @patch("app.price_service.yf.Ticker")
     def test_get_price_data_success(self, mock_ticker, price_service):
         """Test getting detailed price data"""
-        mock_ticker_instance = MagicMock()
-        mock_ticker_instance.info = {
-            "currentPrice": 150.50,
-            "currency": "USD",
-            "marketCap": 2500000000,
-            "volume": 50000000,
-        }
-        mock_ticker.return_value = mock_ticker_instance
+        mock_ticker.return_value = FakeTicker(
+            info={
+                "currentPrice": 150.50,
+                "currency": "USD",
+                "marketCap": 2500000000,
+                "volume": 50000000,
+            }
+        )
 
         price_data = price_service.get_price_data("AAPL")
 
@@ -153,7 +272,20 @@ class TestPriceService:
         assert price_data.market_cap == Decimal("2500000000")
         assert price_data.volume == Decimal("50000000")
 
-    @patch("app.price_service.yf.Ticker")
+    def test_get_price_data_uses_fast_info(self, mock_ticker, price_service):
+        """Test detailed price data is read from fast_info"""
+        mock_ticker.return_value = FakeTicker(
+            fast_info=SimpleNamespace(last_price=150.5, currency="EUR", market_cap=2500000000, last_volume=50000000)
+        )
+
+        price_data = price_service.get_price_data("AAPL")
+
+        assert price_data is not None
+        assert price_data.price == Decimal("150.5")
+        assert price_data.currency == "EUR"
+        assert price_data.market_cap == Decimal("2500000000")
+        assert price_data.volume == Decimal("50000000")
+
     def test_get_price_data_failure(self, mock_ticker, price_service):
         """Test handling failure in getting price data"""
         mock_ticker.side_effect = Exception("Network error")
@@ -172,3 +304,80 @@ class TestPriceService:
         """Test getting last known price when no data exists"""
         price = await price_service._get_last_known_price("NONEXISTENT")
         assert price is None
+
+    async def test_get_last_known_prices_returns_latest_per_symbol(self, price_service, new_db):
+        """Test batched last known price lookup picks the newest row per symbol"""
+        now = utc_now()
+        with app.database.get_session() as session:
+            ids = price_service._get_symbol_ids(session, ["AAPL", "GOOGL", "MSFT"])
+            session.add_all(
+                [
+                    PriceHistory(symbol_id=ids["AAPL"], price=Decimal("140.00"), timestamp=now - timedelta(minutes=10)),
+                    PriceHistory(symbol_id=ids["AAPL"], price=Decimal("150.00"), timestamp=now),
+                    PriceHistory(
+                        symbol_id=ids["GOOGL"], price=Decimal("2500.00"), timestamp=now - timedelta(minutes=5)
+                    ),
+                    PriceHistory(symbol_id=ids["MSFT"], price=Decimal("300.00"), timestamp=now),
+                ]
+            )
+            session.commit()
+
+        prices = await price_service._get_last_known_prices(["AAPL", "GOOGL", "MISSING"])
+
+        assert prices == {"AAPL": Decimal("150.00"), "GOOGL": Decimal("2500.00")}
+        assert await price_service._get_last_known_price("AAPL") == Decimal("150.00")
+
+    async def test_get_last_known_prices_breaks_timestamp_ties(self, price_service, new_db):
+        """Test rows stored under the same timestamp yield the most recently written price"""
+        fetched_at = utc_now()
+        await price_service._store_price_history({"AAPL": Decimal("150.00")}, fetched_at)
+        await price_service._store_price_history({"AAPL": Decimal("151.00")}, fetched_at)
+
+        assert await price_service._get_last_known_prices(["AAPL"]) == {"AAPL": Decimal("151.00")}
+        assert await price_service._get_last_known_price("AAPL") == Decimal("151.00")
+
+    async def test_store_price_history_batch(self, price_service, new_db):
+        """Test a batch of prices is stored under one timestamp"""
+        fetched_at = utc_now()
+        await price_service._store_price_history({"AAPL": Decimal("150.00"), "GOOGL": Decimal("2500.00")}, fetched_at)
+
+        with app.database.get_session() as session:
+            rows = session.exec(select(PriceHistory)).all()
+        assert len(rows) == 2
+        assert {row.timestamp for row in rows} == {fetched_at}
+        prices = await price_service._get_last_known_prices(["AAPL", "GOOGL"])
+        assert prices == {"AAPL": Decimal("150.00"), "GOOGL": Decimal("2500.00")}
+
+    async def test_prune_price_history(self, price_service, new_db):
+        """Test only price history older than the retention window is deleted"""
+        now = utc_now()
+        await price_service._store_price_history({"AAPL": Decimal("140.00")}, now - timedelta(days=31))
+        await price_service._store_price_history({"AAPL": Decimal("150.00")}, now)
+
+        assert price_service.prune_price_history(days=30) == 1
+
+        with app.database.get_session() as session:
+            rows = session.exec(select(PriceHistory)).all()
+        assert [row.price for row in rows] == [Decimal("150.00")]
+
+    async def test_get_symbol_ids_reuses_existing_symbols(self, price_service, new_db):
+        """Test symbol rows are created once per ticker"""
+        with app.database.get_session() as session:
+            first = price_service._get_symbol_ids(session, ["AAPL", "GOOGL"])
+            second = price_service._get_symbol_ids(session, ["GOOGL", "AAPL", "MSFT", "MSFT"])
+            session.commit()
+
+        assert second["AAPL"] == first["AAPL"]
+        assert second["GOOGL"] == first["GOOGL"]
+        assert len(set(second.values())) == 3
+
+
+def test_check_schema_rejects_legacy_price_history(monkeypatch):
+    """Test startup fails clearly on a price_history table that predates the symbols table"""
+    legacy_engine = create_engine("sqlite://")
+    legacy = Table("price_history", MetaData(), Column("id", Integer, primary_key=True), Column("symbol", String))
+    legacy.create(legacy_engine)
+    monkeypatch.setattr(app.database, "ENGINE", legacy_engine)
+
+    with pytest.raises(RuntimeError, match="symbol_id"):
+        app.database.check_schema()
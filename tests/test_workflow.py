@@ -1,118 +1,188 @@
+import asyncio
 import pytest
+from dataclasses import dataclass
 from decimal import Decimal
-from unittest.mock import patch
-from app.database import reset_db
+from typing import Any, Callable
+from unittest.mock import AsyncMock
 from app.portfolio_service import portfolio_service
-from app.models import PortfolioCreate, HoldingCreate, AssetType
+from app.models import Portfolio, PortfolioCreate, PortfolioUpdate, HoldingCreate, HoldingUpdate, AssetType
+
+# Holding amounts and mocked current prices, parsed once for the whole module
+_Q0_5 = Decimal("0.5")
+_Q5 = Decimal("5.0")
+_Q10 = Decimal("10.0")
+_Q20 = Decimal("20.0")
+_P150 = Decimal("150.0")
+_P2000 = Decimal("2000.0")
+_P50000 = Decimal("50000.0")
+_MOCK_PRICES = {
+    "AAPL": Decimal("160.0"),  # +6.67% return
+    "GOOGL": Decimal("2200.0"),  # +10% return
+}
+
+
+@dataclass(frozen=True)
+class CrudSpec:
+    """Service calls and expected (field, value) pairs for the CRUD round trip of one entity type"""
+
+    create: Callable[[Portfolio], Any]
+    get: Callable[[int], Any]
+    update: Callable[[int], Any]
+    delete: Callable[[int], bool]
+    read_field: tuple[str, Any]
+    updated_field: tuple[str, Any]
+
+
+PORTFOLIO_CRUD = CrudSpec(
+    create=lambda portfolio: portfolio_service.create_portfolio(PortfolioCreate(name="Test Portfolio")),
+    get=portfolio_service.get_portfolio,
+    update=lambda portfolio_id: portfolio_service.update_portfolio(
+        portfolio_id, PortfolioUpdate(name="Updated Portfolio")
+    ),
+    delete=portfolio_service.delete_portfolio,
+    read_field=("name", "Test Portfolio"),
+    updated_field=("name", "Updated Portfolio"),
+)
+
+
+def _create_holding(portfolio: Portfolio):
+    """Add the CRUD round-trip holding to a stored portfolio"""
+    assert portfolio.id is not None
+    return portfolio_service.add_holding(
+        HoldingCreate(
+            portfolio_id=portfolio.id,
+            symbol="AAPL",
+            asset_type=AssetType.STOCK,
+            quantity=_Q10,
+            purchase_price=_P150,
+        )
+    )
+
+
+HOLDING_CRUD = CrudSpec(
+    create=_create_holding,
+    get=portfolio_service.get_holding,
+    update=lambda holding_id: portfolio_service.update_holding(holding_id, HoldingUpdate(quantity=_Q20)),
+    delete=portfolio_service.delete_holding,
+    read_field=("symbol", "AAPL"),
+    updated_field=("quantity", _Q20),
+)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mock_prices():
+    """Serve _MOCK_PRICES instead of fetching from yfinance, injected once for the whole module"""
+    mock = AsyncMock(return_value=_MOCK_PRICES)
+    portfolio_service.price_provider = mock
+    yield mock
+    portfolio_service.price_provider = None
+
+
+@pytest.fixture(scope="class")
+def base_portfolio(db_connection):
+    """Create the workflow portfolio once per test class, outside the per-test savepoints"""
+    portfolio_data = PortfolioCreate(name="Investment Portfolio", description="My investment portfolio")
+    return portfolio_service.create_portfolio(portfolio_data)
 
 
 @pytest.fixture
-def new_db():
-    reset_db()
-    yield
-    reset_db()
+def portfolio(new_db, base_portfolio):
+    """Workflow portfolio for one test; holdings added by the test are rolled back with its savepoint"""
+    return base_portfolio
 
 
 class TestWorkflow:
-    def test_complete_portfolio_workflow(self, new_db):
+    def test_complete_portfolio_workflow(self, portfolio):
         """Test the complete workflow from creating portfolio to adding holdings"""
-        # Step 1: Create portfolio
-        portfolio_data = PortfolioCreate(name="Investment Portfolio", description="My investment portfolio")
-        portfolio = portfolio_service.create_portfolio(portfolio_data)
-
+        # Step 1: Portfolio is created by the fixture
         assert portfolio.id is not None
         assert portfolio.name == "Investment Portfolio"
 
-        # Step 2: Add stock holding
+        # Step 2: Prepare stock holding
         stock_holding_data = HoldingCreate(
             portfolio_id=portfolio.id,
             symbol="AAPL",
             asset_type=AssetType.STOCK,
-            quantity=Decimal("10.0"),
-            purchase_price=Decimal("150.0"),
+            quantity=_Q10,
+            purchase_price=_P150,
             notes="Apple stock",
         )
-        stock_holding = portfolio_service.add_holding(stock_holding_data)
-
-        assert stock_holding.symbol == "AAPL"
-        assert stock_holding.quantity == Decimal("10.0")
 
-        # Step 3: Add crypto holding
+        # Step 3: Prepare crypto holding
         crypto_holding_data = HoldingCreate(
             portfolio_id=portfolio.id,
             symbol="BTC-USD",
             asset_type=AssetType.CRYPTOCURRENCY,
-            quantity=Decimal("0.5"),
-            purchase_price=Decimal("50000.0"),
+            quantity=_Q0_5,
+            purchase_price=_P50000,
             notes="Bitcoin",
         )
-        crypto_holding = portfolio_service.add_holding(crypto_holding_data)
 
+        # Step 4: Store both holdings in one transaction
+        stock_holding, crypto_holding = portfolio_service.add_holdings([stock_holding_data, crypto_holding_data])
+
+        assert stock_holding.symbol == "AAPL"
+        assert stock_holding.quantity == _Q10
         assert crypto_holding.symbol == "BTC-USD"
         assert crypto_holding.asset_type == AssetType.CRYPTOCURRENCY
 
-        # Step 4: Get all holdings
+        # Step 5: Get all holdings
         holdings = portfolio_service.get_portfolio_holdings(portfolio.id)
         assert len(holdings) == 2
 
-        # Step 5: Test calculations
-        stock_cost = Decimal("10.0") * Decimal("150.0")  # 1500
-        crypto_cost = Decimal("0.5") * Decimal("50000.0")  # 25000
+        # Step 6: Test calculations
+        stock_cost = _Q10 * _P150  # 1500
+        crypto_cost = _Q0_5 * _P50000  # 25000
         total_cost = stock_cost + crypto_cost  # 26500
 
         assert stock_cost == Decimal("1500.0")
         assert crypto_cost == Decimal("25000.0")
         assert total_cost == Decimal("26500.0")
 
-    @patch("app.portfolio_service.price_service.get_multiple_prices")
-    async def test_portfolio_metrics_calculation(self, mock_get_prices, new_db):
+    async def test_portfolio_metrics_calculation(self, new_db):
         """Test portfolio metrics calculation with mock prices"""
         # Create portfolio and holdings
         portfolio = portfolio_service.create_portfolio(PortfolioCreate(name="Test Portfolio"))
 
         if portfolio.id is not None:
-            portfolio_service.add_holding(
-                HoldingCreate(
-                    portfolio_id=portfolio.id,
-                    symbol="AAPL",
-                    asset_type=AssetType.STOCK,
-                    quantity=Decimal("10.0"),
-                    purchase_price=Decimal("150.0"),
-                )
-            )
-
-            portfolio_service.add_holding(
-                HoldingCreate(
-                    portfolio_id=portfolio.id,
-                    symbol="GOOGL",
-                    asset_type=AssetType.STOCK,
-                    quantity=Decimal("5.0"),
-                    purchase_price=Decimal("2000.0"),
-                )
+            portfolio_service.add_holdings(
+                [
+                    HoldingCreate(
+                        portfolio_id=portfolio.id,
+                        symbol="AAPL",
+                        asset_type=AssetType.STOCK,
+                        quantity=_Q10,
+                        purchase_price=_P150,
+                    ),
+                    HoldingCreate(
+                        portfolio_id=portfolio.id,
+                        symbol="GOOGL",
+                        asset_type=AssetType.STOCK,
+                        quantity=_Q5,
+                        purchase_price=_P2000,
+                    ),
+                ]
             )
 
-        # Mock prices
-        mock_get_prices.return_value = {
-            "AAPL": Decimal("160.0"),  # +6.67% return
-            "GOOGL": Decimal("2200.0"),  # +10% return
-        }
-
         # Get metrics
         if portfolio.id is not None:
-            holdings = await portfolio_service.get_holdings_with_metrics(portfolio.id)
-            summary = await portfolio_service.get_portfolio_summary(portfolio.id)
+            holdings, summary = await asyncio.gather(
+                portfolio_service.get_holdings_with_metrics(portfolio.id),
+                portfolio_service.get_portfolio_summary(portfolio.id),
+            )
 
             # Verify holdings metrics
             assert len(holdings) == 2
+            by_symbol = {h.symbol: h for h in holdings}
 
-            aapl_holding = next(h for h in holdings if h.symbol == "AAPL")
-            assert aapl_holding.current_price == Decimal("160.0")
+            aapl_holding = by_symbol["AAPL"]
+            assert aapl_holding.current_price == _MOCK_PRICES["AAPL"]
             assert aapl_holding.total_cost == Decimal("1500.0")
             assert aapl_holding.current_value == Decimal("1600.0")
             assert aapl_holding.absolute_return == Decimal("100.0")
 
-            googl_holding = next(h for h in holdings if h.symbol == "GOOGL")
-            assert googl_holding.current_price == Decimal("2200.0")
+            googl_holding = by_symbol["GOOGL"]
+            assert googl_holding.current_price == _MOCK_PRICES["GOOGL"]
             assert googl_holding.total_cost == Decimal("10000.0")
             assert googl_holding.current_value == Decimal("11000.0")
             assert googl_holding.absolute_return == Decimal("1000.0")
@@ -125,64 +195,26 @@ class TestWorkflow:
             assert summary.total_absolute_return == Decimal("1100.0")  # 12600 - 11500
             assert summary.best_performer == "GOOGL"  # Higher percentage return
 
-    def test_portfolio_crud_operations(self, new_db):
-        """Test basic CRUD operations for portfolios"""
+    @pytest.mark.parametrize("spec", [PORTFOLIO_CRUD, HOLDING_CRUD], ids=["portfolio", "holding"])
+    def test_crud_operations(self, portfolio, spec):
+        """Test basic CRUD operations for portfolios and holdings"""
         # Create
-        portfolio = portfolio_service.create_portfolio(PortfolioCreate(name="Test Portfolio"))
-        assert portfolio.id is not None
+        entity = spec.create(portfolio)
+        assert entity.id is not None
 
         # Read
-        retrieved = portfolio_service.get_portfolio(portfolio.id)
+        retrieved = spec.get(entity.id)
         assert retrieved is not None
-        assert retrieved.name == "Test Portfolio"
+        assert getattr(retrieved, spec.read_field[0]) == spec.read_field[1]
 
         # Update
-        from app.models import PortfolioUpdate
-
-        updated = portfolio_service.update_portfolio(portfolio.id, PortfolioUpdate(name="Updated Portfolio"))
+        updated = spec.update(entity.id)
         assert updated is not None
-        assert updated.name == "Updated Portfolio"
+        assert getattr(updated, spec.updated_field[0]) == spec.updated_field[1]
 
         # Delete
-        result = portfolio_service.delete_portfolio(portfolio.id)
+        result = spec.delete(entity.id)
         assert result is True
 
-        deleted = portfolio_service.get_portfolio(portfolio.id)
+        deleted = spec.get(entity.id)
         assert deleted is None
-
-    def test_holding_crud_operations(self, new_db):
-        """Test basic CRUD operations for holdings"""
-        # Create portfolio first
-        portfolio = portfolio_service.create_portfolio(PortfolioCreate(name="Test Portfolio"))
-
-        # Create holding
-        if portfolio.id is not None:
-            holding = portfolio_service.add_holding(
-                HoldingCreate(
-                    portfolio_id=portfolio.id,
-                    symbol="AAPL",
-                    asset_type=AssetType.STOCK,
-                    quantity=Decimal("10.0"),
-                    purchase_price=Decimal("150.0"),
-                )
-            )
-            assert holding.id is not None
-
-            # Read
-            retrieved = portfolio_service.get_holding(holding.id)
-            assert retrieved is not None
-            assert retrieved.symbol == "AAPL"
-
-            # Update
-            from app.models import HoldingUpdate
-
-            updated = portfolio_service.update_holding(holding.id, HoldingUpdate(quantity=Decimal("20.0")))
-            assert updated is not None
-            assert updated.quantity == Decimal("20.0")
-
-            # Delete
-            result = portfolio_service.delete_holding(holding.id)
-            assert result is True
-
-            deleted = portfolio_service.get_holding(holding.id)
-            assert deleted is None